@@ -0,0 +1,64 @@
+'''
+Archives of expired partitions: each one is a gzipped COPY text dump of the
+partition, streamed to disk as the server sends it, with its SHA-256 and
+details recorded in a manifest of JSON lines alongside.
+'''
+
+import os
+import gzip
+import json
+import hashlib
+
+# archiving is meant to keep up with the disk, so go easy on the compression
+compress_level = 1
+
+class HashingWriter(object):
+    '''
+    A write only file wrapper that keeps a running SHA-256 and byte count
+    of everything written through it.
+    '''
+    __slots__ = ('f', 'hash', 'size')
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+def copy_to_archive(curs, copy_out_sql, path):
+    '''
+    Runs copy_out_sql, a COPY ... TO STDOUT, on curs writing its output
+    compressed to path, a buffer at a time.  The file is synced before this
+    returns (rows, sha256 of the file, size of the file).
+    '''
+    f = open(path, 'wb')
+    try:
+        writer = HashingWriter(f)
+        gz = gzip.GzipFile(os.path.basename(path), 'wb', compress_level, writer)
+        curs.copy_expert(copy_out_sql, gz)
+        gz.close()
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    return curs.rowcount, writer.hash.hexdigest(), writer.size
+
+def write_manifest(archive_dir, entry):
+    '''
+    Appends entry to the archive directory's manifest.  Callers running in
+    parallel need to hold a lock around this.
+    '''
+    f = open(os.path.join(archive_dir, 'manifest.jsonl'), 'a')
+    try:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
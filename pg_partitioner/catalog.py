@@ -0,0 +1,133 @@
+'''
+An in-process snapshot of the catalog details the partitioner needs about
+the tables it works on.  Everything for a set of tables is loaded with one
+query and then read from memory, so it has to be invalidated by whatever
+changes those details (creating partitions, triggers, indexes, ...).
+'''
+
+import json
+
+snapshot_sql = \
+'''
+SELECT r.requested, c.oid, n.nspname || '.' || c.relname, c.relkind::text,
+    ARRAY(SELECT a.attname::text
+          FROM pg_attribute a
+          WHERE a.attrelid=c.oid AND a.attnum > 0 AND NOT a.attisdropped
+          ORDER BY a.attnum),
+    ARRAY(SELECT pg_catalog.format_type(a.atttypid, a.atttypmod)
+          FROM pg_attribute a
+          WHERE a.attrelid=c.oid AND a.attnum > 0 AND NOT a.attisdropped
+          ORDER BY a.attnum),
+    ARRAY(SELECT pg_get_indexdef(i.indexrelid)
+          FROM pg_index i
+          WHERE i.indrelid=c.oid
+          ORDER BY i.indexrelid),
+    ARRAY(SELECT a.attname::text
+          FROM pg_index i, pg_attribute a
+          WHERE i.indrelid=c.oid AND a.attrelid=c.oid AND a.attnum=i.indkey[0]),
+    ARRAY(SELECT co.contype::text
+          FROM pg_constraint co
+          WHERE co.conrelid=c.oid
+          ORDER BY co.oid),
+    ARRAY(SELECT pg_get_constraintdef(co.oid)
+          FROM pg_constraint co
+          WHERE co.conrelid=c.oid
+          ORDER BY co.oid),
+    ARRAY(SELECT t.tgname::text
+          FROM pg_trigger t
+          WHERE t.tgrelid=c.oid),
+    ARRAY(SELECT pn.nspname || '.' || pc.relname
+          FROM pgpartitioner.partitions p, pg_class pc, pg_namespace pn
+          WHERE p.parent_oid=c.oid AND p.partition_oid=pc.oid AND pc.relnamespace=pn.oid
+          ORDER BY pc.relname),
+    ARRAY(SELECT p.vals[1]
+          FROM pgpartitioner.partitions p, pg_class pc
+          WHERE p.parent_oid=c.oid AND p.partition_oid=pc.oid
+          ORDER BY pc.relname),
+    ARRAY(SELECT p.vals[2]
+          FROM pgpartitioner.partitions p, pg_class pc
+          WHERE p.parent_oid=c.oid AND p.partition_oid=pc.oid
+          ORDER BY pc.relname),
+    ARRAY(SELECT p.partition_type
+          FROM pgpartitioner.partitions p, pg_class pc
+          WHERE p.parent_oid=c.oid AND p.partition_oid=pc.oid
+          ORDER BY pc.relname),
+    ARRAY(SELECT array_to_json(p.vals)::text
+          FROM pgpartitioner.partitions p, pg_class pc
+          WHERE p.parent_oid=c.oid AND p.partition_oid=pc.oid
+          ORDER BY pc.relname)
+FROM unnest(%s::text[]) r(requested), pg_class c, pg_namespace n
+WHERE c.relnamespace=n.oid
+    AND c.oid = r.requested::regclass;
+'''
+
+class TableInfo(object):
+    '''
+    Catalog details for one table as of when the snapshot was loaded.
+    '''
+    __slots__ = ('oid', 'name', 'relkind', 'attributes', 'column_types', 'index_defs',
+                 'indexed_columns', 'constraints', 'triggers', 'partitions',
+                 'partition_bounds', 'partition_vals')
+
+    def __init__(self, row):
+        (self.oid, self.name, self.relkind, atts, types, self.index_defs, indexed, contypes,
+         condefs, triggers, self.partitions, lowers, uppers, part_types, vals) = row
+        self.attributes = tuple(atts)
+        self.column_types = dict(zip(atts, types))
+        self.indexed_columns = set(indexed)
+        self.constraints = zip(contypes, condefs)
+        self.triggers = set(triggers)
+        self.partition_bounds = zip(self.partitions, lowers, uppers)
+        # (partition, partition type, vals) for every type of partition,
+        # partition_bounds only makes sense for range partitions
+        self.partition_vals = []
+        for partition, part_type, vals_json in zip(self.partitions, part_types, vals):
+            part_vals = [v is not None and v.encode('utf-8') or v for v in json.loads(vals_json or '[]')]
+            self.partition_vals.append((partition, part_type, part_vals))
+
+    def get_constraint_defs(self, fkeys=True):
+        '''
+        Constraint definitions as with sql_util.get_constraint_defs().
+        '''
+        return [condef for contype, condef in self.constraints if fkeys or contype != 'f']
+
+class CatalogSnapshot(object):
+    '''
+    TableInfo for each table asked for, keyed by the name it was asked for
+    by and by its schema qualified name.
+    '''
+    __slots__ = ('curs', 'tables')
+
+    def __init__(self, curs):
+        self.curs = curs
+        self.tables = {}
+
+    def load(self, *table_names):
+        '''
+        Loads every given table not already in the snapshot in one query.
+        '''
+        missing = [name for name in table_names if name not in self.tables]
+        if not missing:
+            return
+        self.curs.execute(snapshot_sql, (missing,))
+        for row in self.curs.fetchall():
+            info = self.tables.get(row[2]) or TableInfo(row[1:])
+            self.tables[info.name] = self.tables[row[0]] = info
+
+    def table(self, table_name):
+        if table_name not in self.tables:
+            self.load(table_name)
+        return self.tables[table_name]
+
+    def invalidate(self, table_name=None):
+        '''
+        Drops table_name, under any name it was loaded by, or everything
+        if no table is given, so the next lookup reloads it.
+        '''
+        if table_name is None:
+            self.tables.clear()
+            return
+        info = self.tables.get(table_name)
+        for name, other in self.tables.items():
+            if other is info:
+                del self.tables[name]
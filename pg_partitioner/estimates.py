@@ -0,0 +1,97 @@
+'''
+Row, size and time estimates from a column's planner statistics, used by
+--plan to size up a run without touching the table's data.
+'''
+
+import re
+from bisect import bisect_right
+
+# rough throughputs behind --plan's time estimates, per connection
+plan_rates = {
+    'create': 50,                       # partitions per second
+    'function': 30000,                  # rows moved per second
+    'chunked': 30000,
+    'single-pass': 50000,
+    'blocks': 50000,
+    'copy': 150000,
+    'index': 20 * 1024 * 1024,          # bytes of table indexed per second
+}
+
+class ColumnStats(object):
+    '''
+    A table's size and one column's distribution as of its last ANALYZE.
+    Values are numbers: epoch seconds for timestamps.
+    '''
+    __slots__ = ('reltuples', 'relpages', 'block_size', 'null_frac',
+                 'histogram', 'mcvs')
+
+    def __init__(self, reltuples, relpages, block_size, null_frac, histogram, mcvs, mcv_freqs):
+        self.reltuples = max(reltuples or 0, 0)
+        self.relpages = relpages or 0
+        self.block_size = block_size
+        self.null_frac = null_frac or 0.0
+        self.histogram = [float(v) for v in histogram or []]
+        self.mcvs = zip([float(v) for v in mcvs or []], mcv_freqs or [])
+
+    def analyzed(self):
+        return bool(self.histogram or self.mcvs)
+
+    def row_width(self):
+        if not self.reltuples:
+            return 0
+        return float(self.relpages * self.block_size) / self.reltuples
+
+    def histogram_cdf(self, val):
+        '''
+        Fraction of the histogram below val, interpolating linearly within
+        buckets as the planner does.
+        '''
+        hist = self.histogram
+        if len(hist) < 2 or val <= hist[0]:
+            return 0.0
+        if val >= hist[-1]:
+            return 1.0
+        i = bisect_right(hist, val) - 1
+        width = hist[i + 1] - hist[i]
+        frac = width and (val - hist[i]) / width or 0.0
+        return (i + frac) / (len(hist) - 1)
+
+    def range_fraction(self, lower, upper=None):
+        '''
+        Estimated fraction of the table's rows with lower <= value < upper.
+        '''
+        mcv_total = sum([freq for val, freq in self.mcvs])
+        mcv_frac = sum([freq for val, freq in self.mcvs
+                        if val >= lower and (upper is None or val < upper)])
+        upper_cdf = upper is None and 1.0 or self.histogram_cdf(upper)
+        hist_frac = upper_cdf - self.histogram_cdf(lower)
+        return mcv_frac + max(0.0, 1.0 - self.null_frac - mcv_total) * hist_frac
+
+    def range_rows(self, lower, upper=None):
+        return self.reltuples * self.range_fraction(lower, upper)
+
+def format_bytes(num):
+    for unit in ['bytes', 'kB', 'MB', 'GB']:
+        if abs(num) < 1024:
+            return '%.1f %s' % (num, unit)
+        num /= 1024.0
+    return '%.1f TB' % num
+
+def format_duration(secs):
+    if secs < 60:
+        return '%.1fs' % secs
+    if secs < 3600:
+        return '%dm%02ds' % (secs // 60, secs % 60)
+    return '%dh%02dm' % (secs // 3600, secs % 3600 // 60)
+
+size_units = {'': 1, 'b': 1, 'bytes': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'tb': 1024 ** 4}
+
+def parse_size(size):
+    '''
+    Parses a size such as '512MB' or '10 GB' into bytes, using the same
+    units as PostgreSQL's memory and size settings.
+    '''
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]*)\s*$', str(size).lower())
+    if not m or m.group(2) not in size_units:
+        raise ValueError('Invalid size: %s' % size)
+    return float(m.group(1)) * size_units[m.group(2)]
@@ -0,0 +1,160 @@
+'''
+Client side partition boundary arithmetic.  TimestampCalendar follows the
+rules PostgreSQL uses for timestamp + interval so boundaries come out the
+same as they would on the server, just without a round trip for each one.
+'''
+
+import re
+import calendar
+from datetime import datetime, timedelta
+
+# interval units as (months, days, microseconds), the same three fields a
+# PostgreSQL interval is stored as
+interval_units = {
+    'microsecond': (0, 0, 1),
+    'millisecond': (0, 0, 1000),
+    'second': (0, 0, 1000000),
+    'minute': (0, 0, 60 * 1000000),
+    'hour': (0, 0, 3600 * 1000000),
+    'day': (0, 1, 0),
+    'week': (0, 7, 0),
+    'month': (1, 0, 0),
+    'quarter': (3, 0, 0),
+    'year': (12, 0, 0),
+    'decade': (120, 0, 0),
+    'century': (1200, 0, 0),
+    'millennium': (12000, 0, 0),
+}
+
+unit_aliases = {
+    'us': 'microsecond', 'usec': 'microsecond', 'usecs': 'microsecond', 'microseconds': 'microsecond',
+    'ms': 'millisecond', 'msec': 'millisecond', 'msecs': 'millisecond', 'milliseconds': 'millisecond',
+    's': 'second', 'sec': 'second', 'secs': 'second', 'seconds': 'second',
+    'm': 'minute', 'min': 'minute', 'mins': 'minute', 'minutes': 'minute',
+    'h': 'hour', 'hr': 'hour', 'hrs': 'hour', 'hours': 'hour',
+    'd': 'day', 'days': 'day',
+    'w': 'week', 'weeks': 'week',
+    'mon': 'month', 'mons': 'month', 'months': 'month',
+    'quarters': 'quarter',
+    'y': 'year', 'yr': 'year', 'yrs': 'year', 'years': 'year',
+    'decades': 'decade',
+    'centuries': 'century',
+    'millennia': 'millennium', 'millenniums': 'millennium',
+}
+
+interval_re = re.compile(r'\s*([+-]?\d+)\s*([a-z]+)\s*')
+
+name_formats = ('%Y%m%d', '%Y%m%d%H%M%S')
+parse_formats = name_formats + ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f')
+
+def parse_interval(interval):
+    '''
+    Parses an interval string such as '3 months' or '1 day 12 hours' into
+    a (months, days, microseconds) tuple.  Raises ValueError for anything
+    it doesn't understand.
+    '''
+    months = days = usecs = 0
+    pos = 0
+    interval = interval.strip().lower()
+    while pos < len(interval):
+        m = interval_re.match(interval, pos)
+        if not m:
+            raise ValueError('Invalid interval: %s' % interval)
+        count, unit = int(m.group(1)), unit_aliases.get(m.group(2), m.group(2))
+        if unit not in interval_units:
+            raise ValueError('Invalid interval unit: %s' % m.group(2))
+        u_months, u_days, u_usecs = interval_units[unit]
+        months += count * u_months
+        days += count * u_days
+        usecs += count * u_usecs
+        pos = m.end()
+    if not (months or days or usecs):
+        raise ValueError('Invalid interval: %s' % interval)
+    return months, days, usecs
+
+def add_interval(ts, interval):
+    '''
+    Adds a (months, days, microseconds) interval to a datetime the way
+    PostgreSQL does for timestamps: months first, with the day clamped to
+    the end of the resulting month, then days, then time.
+    '''
+    months, days, usecs = interval
+    if months:
+        month = ts.month - 1 + months
+        year = ts.year + month // 12
+        month = month % 12 + 1
+        day = min(ts.day, calendar.monthrange(year, month)[1])
+        ts = ts.replace(year=year, month=month, day=day)
+    return ts + timedelta(days=days, microseconds=usecs)
+
+class TimestampCalendar(object):
+    '''
+    Partition boundaries for date and timestamp columns, every interval
+    apart.  Partitions of a day or more are named and bounded by YYYYMMDD
+    values as they always have been, smaller ones get the time of day too.
+    '''
+    def __init__(self, interval):
+        self.interval = parse_interval(interval)
+        self.sub_day = bool(self.interval[2])
+
+    def parse(self, val):
+        for fmt in parse_formats:
+            try:
+                return datetime.strptime(val, fmt)
+            except ValueError:
+                pass
+        raise ValueError('Unrecognized timestamp: %s' % val)
+
+    def next(self, val):
+        return add_interval(val, self.interval)
+
+    def format_name(self, val):
+        return val.strftime(name_formats[self.sub_day])
+
+    def to_number(self, val):
+        '''
+        val as seconds since the epoch, matching extract(epoch FROM val) for
+        timestamps without time zone.
+        '''
+        return calendar.timegm(val.timetuple()) + val.microsecond / 1000000.0
+
+    def format_val(self, val):
+        if self.sub_day:
+            return val.strftime('%Y-%m-%d %H:%M:%S')
+        return val.strftime('%Y%m%d')
+
+    def bounds(self, start, end):
+        '''
+        Returns the (lower, upper) bounds of each partition from start up to
+        the one containing end.
+        '''
+        bounds = []
+        lower = start
+        while lower <= end:
+            upper = self.next(lower)
+            if upper <= lower:
+                raise ValueError('Partition interval must be positive.')
+            bounds.append((lower, upper))
+            lower = upper
+        return bounds
+
+class IntegerCalendar(TimestampCalendar):
+    '''
+    Partition boundaries for integer columns, step apart.
+    '''
+    def __init__(self, step):
+        self.interval = int(step)
+
+    def parse(self, val):
+        return int(val)
+
+    def next(self, val):
+        return val + self.interval
+
+    def to_number(self, val):
+        return float(val)
+
+    def format_name(self, val):
+        return str(val)
+
+    format_val = format_name
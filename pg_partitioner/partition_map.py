@@ -0,0 +1,111 @@
+'''
+A client side map of a partitioned table's partitions, for applications to
+insert straight into the right partition without going through the parent's
+trigger and to query only the partitions a range of values touches:
+
+    from pg_partitioner.partition_map import PartitionMap
+
+    pmap = PartitionMap(curs, 'foo')
+    curs.execute('INSERT INTO %s (val, val_ts) VALUES (%%s, %%s);' % pmap.route(ts), (val, ts))
+    for partition in pmap.prune(start, end):
+        ...
+
+The bounds are kept in sorted arrays so both lookups are binary searches.
+Every change to a table's rows in pgpartitioner.partitions bumps its row in
+pgpartitioner.partition_versions, so a long running process can call
+refresh() as often as it likes and only reload the map when its partitions
+have changed.
+'''
+
+from bisect import bisect_left, bisect_right
+
+parent_sql = 'SELECT col_type, partition_type FROM pgpartitioner.parents WHERE parent_oid=%s::regclass;'
+
+version_sql = 'SELECT version FROM pgpartitioner.partition_versions WHERE parent_oid=%s::regclass;'
+
+bounds_sql = \
+'''
+SELECT n.nspname || '.' || c.relname, p.vals[1]::%(col_type)s, p.vals[2]::%(col_type)s
+FROM pgpartitioner.partitions p, pg_class c, pg_namespace n
+WHERE p.parent_oid=%%s::regclass AND p.partition_oid=c.oid AND c.relnamespace=n.oid
+ORDER BY p.vals[1]::%(col_type)s;
+'''
+
+class PartitionMap(object):
+    '''
+    The range partitions of table_name as of the last load.  Values are
+    compared in Python, so they should be of the type psycopg2 returns for
+    the partition column: datetime for timestamps, date for dates and int
+    for integers.  col_type is only needed for tables whose create stage
+    hasn't recorded it in pgpartitioner.parents.  Hash and list partitioned
+    tables aren't supported, their routing is left to the server.
+    '''
+    __slots__ = ('table_name', 'col_type', 'version', 'partitions', 'lowers', 'uppers')
+
+    def __init__(self, curs, table_name, col_type=None):
+        self.table_name = table_name
+        self.col_type = col_type
+        curs.execute(parent_sql, (table_name,))
+        res = curs.fetchone()
+        if res and res[1] != 'range':
+            raise ValueError("%s is %s partitioned, only range partitions can be mapped." % (table_name, res[1]))
+        if col_type is None:
+            if not res:
+                raise ValueError("%s's partition column type isn't recorded, give it as col_type." % table_name)
+            self.col_type = res[0]
+        self.load(curs)
+
+    def load(self, curs):
+        '''
+        Reads the partitions and their bounds along with the version they're
+        at.  The version is read first so a change made in between is seen
+        as a change by the next refresh() rather than missed.
+        '''
+        self.version = self.current_version(curs)
+        curs.execute(bounds_sql % {'col_type': self.col_type}, (self.table_name,))
+        rows = curs.fetchall()
+        self.partitions = [row[0] for row in rows]
+        self.lowers = [row[1] for row in rows]
+        self.uppers = [row[2] for row in rows]
+
+    def current_version(self, curs):
+        curs.execute(version_sql, (self.table_name,))
+        return curs.rowcount and curs.fetchone()[0] or 0
+
+    def refresh(self, curs):
+        '''
+        Reloads the map if the table's partitions have changed since it was
+        last loaded, which costs one primary key lookup when they haven't.
+        Returns whether it was reloaded.
+        '''
+        if self.current_version(curs) == self.version:
+            return False
+        self.load(curs)
+        return True
+
+    def route(self, value):
+        '''
+        The partition value belongs in, or None if there isn't one.
+        '''
+        i = bisect_right(self.lowers, value) - 1
+        if i < 0 or (self.uppers[i] is not None and value >= self.uppers[i]):
+            return None
+        return self.partitions[i]
+
+    def prune(self, lo=None, hi=None):
+        '''
+        The partitions, in order, holding any values in [lo, hi).  Either
+        end can be None for no bound on that side.
+        '''
+        start = 0
+        if lo is not None:
+            start = max(bisect_right(self.lowers, lo) - 1, 0)
+            if start < len(self.uppers) and self.uppers[start] is not None and self.uppers[start] <= lo:
+                start += 1
+        end = len(self.lowers)
+        if hi is not None:
+            end = bisect_left(self.lowers, hi)
+        return self.partitions[start:end]
+
+    def __len__(self):
+        return len(self.partitions)
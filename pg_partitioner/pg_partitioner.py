@@ -1,24 +1,58 @@
 #!/usr/bin/env python
 
-import sys, os, re
+import sys, os, re, time
+import threading
+import shutil, tempfile
 import psycopg2
+from psycopg2 import errorcodes
 import cmd
 from optparse import OptionGroup
 from script import DBScript
 from sql_util import *
+from intervals import TimestampCalendar, IntegerCalendar, parse_interval
+from catalog import CatalogSnapshot
+from estimates import ColumnStats, plan_rates, format_bytes, format_duration, parse_size
+from throttle import Throttle
+from progress import MigrationProgress
+from archive import copy_to_archive, write_manifest
 
 try:
     import readline
 except:
     pass
 
-def_table_schema = \
-'''
-SELECT n.nspname
-FROM pg_namespace n, pg_class t
-WHERE t.relnamespace=n.oid
-    AND t.relname=%s AND pg_table_is_visible(t.oid)
-'''
+# partitions created per statement sent by build_tables
+ddl_batch_size = 500
+
+# the bucket, formatted with a hash of a column and the modulus, that a value
+# falls in for hash partitioning
+hash_sql = '(abs(%s::bigint) %% %s)'
+
+# how values of each column type that can be hash partitioned are hashed.  
+# The text form of dates, timestamps, floats, bytea and the like depends on
+# session settings (DateStyle, TimeZone, extra_float_digits, bytea_output) 
+# so hashing it would send the same value to different partitions from 
+# different sessions.  Dates are hashed as a day number and bytea by its hex.
+hash_funcs = [(re.compile(r'^(smallint|integer|bigint)$'), 'hashint8((%s)::bigint)'),
+              (re.compile(r'^(text|character varying|character)(\(\d+\))?$'), 'hashtext((%s)::text)'),
+              (re.compile(r'^uuid$'), 'uuid_hash((%s)::uuid)'),
+              (re.compile(r'^bytea$'), "hashtext(encode((%s)::bytea, 'hex'))"),
+              (re.compile(r'^date$'), "hashint8(((%s)::date - '2000-01-01'::date)::bigint)")]
+
+def hash_func(col_type):
+    '''
+    The hash_funcs entry for col_type, or None if it can't be hash partitioned.
+    '''
+    for type_re, func in hash_funcs:
+        if type_re.match(col_type):
+            return func
+    return None
+
+# how long --online waits on the parent's lock to install the trigger before
+# backing off so it never queues application traffic up behind it for long,
+# and how many times it tries
+online_lock_timeout = '2s'
+online_lock_retries = 30
 
 stages = {'create': 1,
           'migrate': 2,
@@ -39,6 +73,26 @@ class DatePartitioner(DBScript):
                      help="One of: create, migrate, post, all.  create -> create partition tables, migrate -> migrate data from parent to partitions, post -> create indexes, constraints and, optionally, fkeys on partitions.")
         g.add_option('--schema', action='store_true', default=False,
                      help="Forces the partitioner schema to be loaded.  Can be run as the only non-connection option with no arguments.")
+        g.add_option('--maintain', type='int', metavar='COUNT',
+                     help="Instead of partitioning a table, make sure every table partitioned here, or just TABLE if given, has at least COUNT partitions for times yet to come, creating them as its create stage last did.  Only the newest partition's bounds are read, nothing is scanned, and the insert function is only regenerated for tables that got new partitions.  Tables partitioned on integer columns are skipped.")
+        g.add_option('--interval', type='float', metavar='SECONDS',
+                     help="With --maintain, keep running and repeat every SECONDS.")
+        g.add_option('--expire', metavar='CUTOFF',
+                     help="Instead of partitioning TABLE, archive and then drop its partitions whose ranges end on or before CUTOFF: a value of the partition column or, for time partitioned tables, an interval such as '1 year' for that long before now.  Each partition is dumped with COPY into a gzipped file in --archive-dir, with its checksum, row count and bounds added to manifest.jsonl there, --jobs partitions at a time.  The partition column can be given after TABLE for tables whose create stage hasn't been run since --maintain was added.")
+        g.add_option('--archive-dir', metavar='DIR',
+                     help="With --expire, the directory the archives and their manifest are written to.")
+        g.add_option('--detach', action="store_true", default=False,
+                     help="With --expire, detach the archived partitions from the parent instead of dropping them.")
+        g.add_option('--merge', nargs=2, metavar='LOWER UPPER',
+                     help="Instead of partitioning TABLE, combine its adjacent partitions lying within [LOWER, UPPER) into one, named after the first of them.  The rows are copied in partition column order into a new table that gets its indexes built once it's full, writes to the partitions being merged are blocked meanwhile but reads aren't, and the old partitions are only locked exclusively to be swapped for it.  The insert function is regenerated to route to it.  The partition column can be given after TABLE as with --expire.")
+        g.add_option('--split', metavar='PARTITION',
+                     help="Instead of partitioning TABLE, divide its partition PARTITION into partitions of --units * --scale, e.g. -u day for a monthly partition, bounded and named as the create stage would.  PARTITION is read once with each row routed into its new partition, writes to it are blocked meanwhile but reads aren't, and it's only locked exclusively to be swapped for them.  With --jobs the new partitions are committed before they're swapped in so their indexes can be built in parallel.  The partition column can be given after TABLE as with --expire.")
+        g.add_option('--partition-type', type='choice', choices=['range', 'hash', 'list'], default='range',
+                     help="One of: range, hash, list.  range -> each partition holds a range of PARTITION_FIELD values as set by the options below, hash -> rows are spread over --modulus partitions by a hash of PARTITION_FIELD, which must be an integer, text, uuid, bytea or date column, for spreading out writes that would otherwise all land in the newest range partition, list -> each partition holds a given set of PARTITION_FIELD values, see --values.  hash and list partitions need the static row trigger and the inherits backend, and are migrated with the single-pass strategy unless blocks or copy is given.  Defaults to range.")
+        g.add_option('--modulus', type='int', metavar='N',
+                     help="With --partition-type hash, the number of partitions.  It can't be changed once a table's partitions are created.")
+        g.add_option('--values', metavar='LIST',
+                     help="With --partition-type list, the values each partition holds: values within a partition separated by commas and partitions by semicolons, e.g. 'US,CA;GB;DE,FR'.  Values already held by a partition are skipped.  Defaults to a partition for each distinct PARTITION_FIELD value in TABLE.")
         g.add_option('-u', '--units', dest="units", metavar='UNIT',
                      help="A valid PG unit for the column partitioned on.  Defaults to month for timestamp/date columns and 10% of the available data range for integer column types")
         g.add_option('--scale', type='int', metavar='COUNT',
@@ -52,8 +106,42 @@ class DatePartitioner(DBScript):
         #              help="When creating tables, ignore any errors instead of rolling completely back. Default: False.")
         g.add_option('--chunk', type='int', default=1000, 
                      help="Valid for the migrate stage.  Sets X where X is the # of rows to successively move from the parent to partition tables until all rows (that can be) have been moved, defaults to 1000.  Any rows for which no valid child table exists are left in the parent.")
+        g.add_option('-j', '--jobs', type='int', default=1, metavar='N',
+                     help="Valid for the migrate and post stages.  Moves the data for, or builds the indexes of, N partitions at a time, each over its own connection.  Anything done before the migration or index builds is committed first and each partition's data or index is committed as soon as it's done.  Defaults to 1.")
+        g.add_option('--concurrently', action="store_true", default=False,
+                     help="Valid for the post stage.  Build the partitions' indexes with CREATE INDEX CONCURRENTLY so writes to them aren't blocked.  Implies committing each index as it's built as with --jobs.")
+        g.add_option('--maintenance-work-mem', metavar='SIZE',
+                     help="Valid for the post stage with --jobs or --concurrently.  maintenance_work_mem for each index building connection, e.g. 1GB.")
+        g.add_option('--strategy', type='choice', choices=['function', 'copy', 'chunked', 'single-pass', 'blocks'], default='function',
+                     help="Valid for the migrate stage.  One of: function, copy, chunked, single-pass, blocks.  function -> rows are moved --chunk at a time by the pgpartitioner.move_partition_data() server function, copy -> each partition's rows are streamed out of the parent and into the partition with binary COPY over two connections and committed per partition, chunked -> every --chunk rows moved are committed along with a checkpoint so an interrupted migration resumes where it stopped when re-run, single-pass -> the parent is read once in one statement with every row routed to its partition as it goes, no index on the partition column is needed, blocks -> like single-pass but the parent's blocks are split into ranges that are read in parallel over --jobs connections and committed per range (PostgreSQL 14+).  Defaults to function.")
+        g.add_option('--online', action='store_true', default=False,
+                     help="Valid for the migrate stage.  For tables that can't stop taking writes: the partition trigger is installed and committed first so new rows go straight to the partitions, then the parent is drained with the chunked strategy, every --chunk rows in their own short transaction, over --jobs connections.  Rows updated in the parent meanwhile stay there and are picked up by further passes until one finds nothing left to move.  Not for use with --routing statement or --backend native.")
+        g.add_option('--max-rate', type='float', metavar='ROWS',
+                     help="Valid for the migrate stage.  Move at most ROWS rows per second, across all --jobs.  Implies the chunked strategy, as do --max-wal-rate and --max-replica-lag.  These limits are kept in pgpartitioner.migration_limits for the duration of the migration and can be changed there, or the migration paused, while it runs.")
+        g.add_option('--max-wal-rate', metavar='SIZE',
+                     help="Valid for the migrate stage.  Slow down the migration to keep the server's WAL generation, going by pg_current_wal_lsn(), under SIZE per second, e.g. 20MB.")
+        g.add_option('--max-replica-lag', type='float', metavar='SECONDS',
+                     help="Valid for the migrate stage.  Pause the migration whenever any replica in pg_stat_replication is more than SECONDS behind on replay.")
+        g.add_option('--progress', metavar='FILE',
+                     help="Valid for the migrate stage.  Report the rows and bytes moved, elapsed time, rows per second and an ETA, going by the rows estimated from the table's statistics, for each partition and chunk as the migration goes.  FILE gets a JSON line appended for each, - for stdout, or see --progress-format.  Implies committing each partition as it's done, as with --jobs.  Not for the single-pass and blocks strategies, which move every partition at once.")
+        g.add_option('--progress-format', type='choice', choices=['json', 'prometheus'], default='json',
+                     help="One of: json, prometheus.  json -> a JSON object per line for each chunk or partition moved, prometheus -> FILE is rewritten after each with gauges for the table and each partition, for the node exporter's textfile collector.  Defaults to json.")
+        g.add_option('--target-rows', type='int', metavar='ROWS',
+                     help="Instead of one partition per --units * --scale, merge consecutive steps of that size into partitions of about ROWS rows each.  Steps already covered by a partition are skipped and steps with no rows are folded into a neighbouring partition.  Row counts are estimated from the column's statistics (run ANALYZE first) or --sample, as are the default --start and --end so the table isn't scanned for them.")
+        g.add_option('--target-size', metavar='SIZE',
+                     help="As --target-rows but aiming for partitions of about SIZE, e.g. 10GB, going by the table's average row size.")
+        g.add_option('--sample', type='float', metavar='PERCENT',
+                     help="With --target-rows or --target-size, estimate row counts from a TABLESAMPLE SYSTEM scan of PERCENT of the table rather than its statistics.")
+        g.add_option('--plan', action='store_true', default=False,
+                     help="Print what the given stage(s) would do: the partitions and their DDL, the index builds and, per partition, the estimated rows and bytes to be moved along with rough times for each stage.  The estimates come from the table's statistics so nothing is scanned (run ANALYZE first) and nothing is changed.")
         g.add_option('-f', '--fkeys', action="store_true", default=False,
                     help="Include building any fkeys present on the parent on the partitions.")
+        g.add_option('--trigger', type='choice', choices=['static', 'dynamic'], default='static',
+                     help="One of: static, dynamic.  static -> the parent's insert function has every partition's bounds written into it as a binary search and is regenerated whenever partitions are added, dynamic -> the insert function looks up the partitions and their bounds for each row.  Defaults to static.")
+        g.add_option('--routing', type='choice', choices=['row', 'statement'], default='row',
+                     help="One of: row, statement.  row -> a BEFORE INSERT trigger routes each row as it is inserted, statement -> an AFTER INSERT statement trigger moves each inserted batch into the partitions with one INSERT ... SELECT per partition touched (requires PostgreSQL 10+).  Only the inserted rows are moved, matched on the primary key or, without one, on every column.  Neither mode routes UPDATEs, rows updated in the parent are left there for the migrate stage.  Defaults to row.")
+        g.add_option('--backend', type='choice', choices=['inherits', 'native'], default='inherits',
+                     help="One of: inherits, native.  inherits -> partitions inherit from the parent and a trigger routes inserts into them, native -> partitions are created, filled and indexed as with inherits, with the trigger routing inserts into them from the create stage on so the parent's rows stay visible through it throughout, and at the end of the post stage they're detached from the parent and attached to a PARTITION BY RANGE table that takes over its name, constraints, defaults, comments, owner and grants (PostgreSQL 11+).  The post stage refuses to run for tables with views, rules, policies, column grants, identity columns or triggers of their own, or foreign keys referencing them, as they'd be left behind.  The partitions' CHECK constraints, which also rule out a NULL PARTITION_FIELD, let ATTACH PARTITION skip scanning each partition and the trigger is dropped.  Whatever couldn't be migrated is left in the old parent, renamed to TABLE_unpartitioned.  Partitions added to a natively partitioned table are created as PARTITION OF it directly.  Defaults to inherits.")
                      
         parser.add_option_group(g)
         
@@ -61,6 +149,34 @@ class DatePartitioner(DBScript):
     
     def validate_opts(self):
         self.load_partitioner_schema()
+        
+        if self.opts.maintain is not None:
+            if self.args and not table_exists(self.curs, self.args[0])[0]:
+                self.parser.error("%s does not exist in the given database." % self.args[0])
+            self.catalog = CatalogSnapshot(self.curs)
+            return
+        
+        if self.opts.expire is not None:
+            if not self.args or not table_exists(self.curs, self.args[0])[0]:
+                self.parser.error("--expire needs a table that exists in the given database.")
+            if not self.opts.archive_dir:
+                self.parser.error("--expire needs an --archive-dir to archive the partitions to.")
+            self.catalog = CatalogSnapshot(self.curs)
+            return
+        
+        if self.opts.merge:
+            if not self.args or not table_exists(self.curs, self.args[0])[0]:
+                self.parser.error("--merge needs a table that exists in the given database.")
+            self.catalog = CatalogSnapshot(self.curs)
+            return
+        
+        if self.opts.split:
+            if not self.args or not table_exists(self.curs, self.args[0])[0]:
+                self.parser.error("--split needs a table that exists in the given database.")
+            if not self.opts.units:
+                self.parser.error("--split needs --units for the new partitions' ranges.")
+            self.catalog = CatalogSnapshot(self.curs)
+            return
             
         if len(self.args) < 2:
             self.parser.error("date_partitioner.py requires both a table name and timestamp field name on that table as arguments.")
@@ -72,39 +188,92 @@ class DatePartitioner(DBScript):
             print "Invalid stage: %s.  Valid options are: ", (self.opts.stage, ','.join(stages.values()))
             sys.exit()
         
-        self.col_type = get_column_type(self.curs, self.args[0], self.args[1])
+        if self.opts.online and (self.opts.routing == 'statement' or self.opts.backend == 'native'):
+            self.parser.error("--online needs the row routing trigger, it can't be used with --routing statement or --backend native.")
+        if self.opts.online and self.opts.strategy not in ('function', 'chunked'):
+            self.parser.error("--online always migrates with the chunked strategy.")
+        if self.throttled() and self.opts.strategy not in ('function', 'chunked'):
+            self.parser.error("--max-rate, --max-wal-rate and --max-replica-lag need the chunked strategy.")
+        if self.opts.max_wal_rate:
+            try:
+                self.opts.max_wal_rate = parse_size(self.opts.max_wal_rate)
+            except ValueError, e:
+                self.parser.error(str(e))
+        if self.opts.partition_type != 'range':
+            self.validate_partition_type_opts()
+        if self.opts.progress and self.opts.strategy in ('single-pass', 'blocks'):
+            self.parser.error("--progress reports on each partition as it's moved, the single-pass and blocks strategies move them all at once, use another --strategy.")
+        
+        self.catalog = CatalogSnapshot(self.curs)
+        info = self.catalog.table(self.args[0])
+        self.col_type = info.column_types.get(self.args[1])
         if not self.col_type:
             self.parser.error("%s does not exist on %s." % (self.args[1], self.args[0]))
-        self.set_range_vars()
+        if self.opts.partition_type == 'hash' and not hash_func(self.col_type):
+            self.parser.error("--partition-type hash needs an integer, text, uuid, bytea or date column, %s is %s." 
+                              % (self.args[1], self.col_type))
+        part_types = set([part_type for partition, part_type, vals in info.partition_vals])
+        if part_types and part_types != set([self.opts.partition_type]):
+            self.parser.error("%s already has %s partitions, give --partition-type %s." 
+                              % (self.args[0], ', '.join(part_types), ', '.join(part_types)))
+        if self.opts.partition_type != 'range' and info.relkind == 'p':
+            self.parser.error("%s is natively partitioned by range, it can't have %s partitions added."
+                              % (self.args[0], self.opts.partition_type))
+        if self.opts.partition_type == 'range':
+            self.set_range_vars()
+    
+    def validate_partition_type_opts(self):
+        '''
+        Checks the options work with hash or list partitions, which are
+        only routed by the static row trigger and moved by the strategies
+        going by the generated route function or the partitions' CHECK
+        constraints.
+        '''
+        part_type = self.opts.partition_type
+        if self.opts.backend == 'native':
+            self.parser.error("--partition-type %s needs --backend inherits." % part_type)
+        if self.opts.trigger == 'dynamic' or self.opts.routing == 'statement':
+            self.parser.error("--partition-type %s needs the static row trigger." % part_type)
+        if self.opts.online or self.throttled() or self.opts.strategy == 'chunked':
+            self.parser.error("--partition-type %s partitions are migrated with the single-pass, blocks or copy strategies." 
+                              % part_type)
+        if self.opts.plan or self.adaptive():
+            self.parser.error("--plan, --target-rows and --target-size only work with range partitions.")
+        if part_type == 'hash' and self.run_stage('create') and (not self.opts.modulus or self.opts.modulus < 1):
+            self.parser.error("--partition-type hash needs a --modulus of at least 1 to create partitions.")
+        if self.opts.strategy == 'function':
+            self.opts.strategy = 'single-pass'
 
     def run_stage(self, stage):
         return  stages[self.opts.stage] & stages[stage] and True or False
     
+    def table_info(self):
+        '''
+        The parent table's details from the catalog snapshot.
+        '''
+        return self.catalog.table(self.qualified_table_name)
+    
     def table_is_partitioned(self):
-        self.curs.execute('SELECT pgpartitioner.get_partitions(%s)', (self.qualified_table_name,))
-        if self.curs.rowcount:
-            return True
-        return False
+        return bool(self.table_info().partitions)
     
     def table_has_partition_trig(self):
-        trig_check_sql = \
+        return '%s_partition_trigger' % self.table_name in self.table_info().triggers
+    
+    def natively_partitioned(self):
+        return self.table_info().relkind == 'p'
+    
+    def native(self):
         '''
-        SELECT 1
-        FROM pg_trigger t
-        WHERE t.tgrelid='%s'::regclass
-            AND t.tgname='%s_partition_trigger';
+        Whether partitions are native ones, either because --backend native
+        was asked for or the parent already is a PARTITION BY table.
         '''
-        
-        self.curs.execute(trig_check_sql % (self.qualified_table_name, self.table_name))
-        if self.curs.rowcount:
-            return True
-        return False
+        return self.opts.backend == 'native' or self.natively_partitioned()
         
     
     def set_range_vars(self):
         def_dates_sql = \
         '''
-        SELECT to_char(date_trunc('%s', MIN(%s)), 'YYYYMMDD'), to_char(MAX(%s), 'YYYYMMDD')
+        SELECT to_char(date_trunc('%s', MIN(%s)), 'YYYYMMDDHH24MISS'), to_char(MAX(%s), 'YYYYMMDDHH24MISS')
         FROM %s;
         '''
 
@@ -114,17 +283,36 @@ class DatePartitioner(DBScript):
         FROM %s;
         '''
         
+        # plans take the default range from the column's statistics rather 
+        # than scanning the table
+        stats_vals_sql = \
+        '''
+        (SELECT v::%s AS %s
+         FROM pg_stats s, unnest(s.histogram_bounds::text::text[] || s.most_common_vals::text::text[]) v
+         WHERE s.schemaname=%s AND s.tablename=%s AND s.attname=%s AND NOT s.inherited) stats
+        '''
+        
+        sample_vals_sql = '(SELECT %s FROM ONLY %s TABLESAMPLE SYSTEM (%s)) stats'
+        
+        source = self.args[0]
+        if self.adaptive() and self.opts.sample:
+            source = sample_vals_sql % (self.args[1], self.args[0], self.opts.sample)
+        elif self.opts.plan or self.adaptive():
+            schema, table = self.catalog.table(self.args[0]).name.split('.', 1)
+            source = stats_vals_sql % (self.col_type, self.args[1], quote_literal(schema), 
+                                       quote_literal(table), quote_literal(self.args[1]))
+        
         if self.col_type == 'date' or re.search('time[^\]]*$', self.col_type):
             self.short_type = 'ts'
             units = self.opts.units or 'month'
-            self.curs.execute(def_dates_sql % (units, self.args[1], self.args[1], self.args[0]))
+            self.curs.execute(def_dates_sql % (units, self.args[1], self.args[1], source))
         elif re.search('int[^\]]*$', self.col_type):
             self.short_type = 'int'
             try:
                 units = int(self.opts.units)
             except TypeError:
                 units = 1
-            self.curs.execute(def_ints_sql % (units, self.args[1], units, units, self.args[1], units, self.args[0]))
+            self.curs.execute(def_ints_sql % (units, self.args[1], units, units, self.args[1], units, source))
         else:
             raise RuntimeError("The type of %s (%s) is not valid for partitioning on (at this time)." 
                                 % (self.args[1], self.col_type))
@@ -134,82 +322,952 @@ class DatePartitioner(DBScript):
             if res[0] is None:
                 self.parser.error("No data in table to use for default values, you'll need to specify explicit dates if you want to partition this table.")
             self.opts.start = res[0]
+        self.opts.end = self.opts.end or res[1]
+        if self.opts.end is None:
+            self.parser.error("No data in table to use for default values, you'll need to specify an explicit end if you want to partition this table.")
         
         if self.short_type == 'ts':
-            self.opts.start = normalize_date(self.curs, self.opts.start, 'YYYYMMDD', units)
+            self.opts.start = normalize_date(self.curs, self.opts.start, 'YYYYMMDDHH24MISS', units)
             self.opts.units = str(self.opts.scale) + ' ' + units
+            try:
+                self.calendar = TimestampCalendar(self.opts.units)
+            except ValueError, e:
+                self.parser.error(str(e))
         elif self.short_type == 'int':
             self.opts.start = units * (int(self.opts.start)/units)
             self.opts.units = str(self.opts.scale * units)
+            self.calendar = IntegerCalendar(self.opts.units)
         
-        self.opts.end = self.opts.end or res[1]
+        self.range_start = self.parse_range_val(self.opts.start)
+        self.range_end = self.parse_range_val(self.opts.end)
+    
+    def throttled(self):
+        return (self.opts.max_rate is not None or self.opts.max_wal_rate is not None 
+                or self.opts.max_replica_lag is not None)
+    
+    def adaptive(self):
+        return bool(self.opts.target_rows or self.opts.target_size)
+    
+    def parse_range_val(self, val):
+        '''
+        Parses a partition column value with the calendar, falling back on 
+        the server for date strings in formats the calendar doesn't know.
+        '''
+        try:
+            return self.calendar.parse(str(val))
+        except ValueError:
+            if self.short_type != 'ts':
+                raise
+        self.curs.execute("SELECT to_char(%s::timestamp, 'YYYYMMDDHH24MISS');", (val,))
+        return self.calendar.parse(self.curs.fetchone()[0])
         
-    def nextInterval(self, val):
-        if self.short_type == 'ts':
-            sql = "SELECT to_char(%s::timestamp + %s, 'YYYYMMDD')"
-            self.curs.execute(sql, (val, self.opts.units))
-            return self.curs.fetchone()[0]
-        elif self.short_type == 'int':
-            return str(int(val) + int(self.opts.units))
+    def get_partition_ranges(self):
+        '''
+        Returns a (partition, start, end) tuple for each partition in the
+        range given by the options, whether or not it already exists.
+        '''
+        bounds = self.calendar.bounds(self.range_start, self.range_end)
+        if self.adaptive():
+            bounds = self.get_adaptive_bounds(bounds)
         
-    def build_tables(self):
+        ranges = []
+        for lower, upper in bounds:
+            partition = '%s_%s' % (self.qualified_table_name, self.calendar.format_name(lower))
+            ranges.append((partition, self.calendar.format_val(lower), self.calendar.format_val(upper)))
+        return ranges
+    
+    def get_adaptive_bounds(self, steps):
+        '''
+        Merges consecutive calendar steps into variable width ranges of about
+        --target-rows rows (or --target-size bytes) each, going by the
+        column's statistics or a --sample of the table.  Steps overlapping an
+        existing partition are left out.  Steps estimated to have under a
+        row are folded into the partition before them, or after them at the 
+        start of a run, so a few rows the estimate missed still have a 
+        partition to go to.
+        '''
+        num = self.calendar.to_number
+        stats = self.get_column_stats()
+        target = self.opts.target_rows
+        if not target:
+            if not stats.row_width():
+                self.parser.error("%s has no size statistics to work out --target-size with, run ANALYZE on it first." 
+                                  % self.qualified_table_name)
+            try:
+                target = parse_size(self.opts.target_size) / stats.row_width()
+            except ValueError, e:
+                self.parser.error(str(e))
+        
+        if self.opts.sample:
+            step_rows = self.sample_step_rows(steps)
+        else:
+            if not stats.analyzed():
+                self.parser.error("%s has no statistics for %s, run ANALYZE on it first or use --sample." 
+                                  % (self.qualified_table_name, self.part_column))
+            step_rows = [stats.range_rows(num(lower), num(upper)) for lower, upper in steps]
+        
+        taken = self.taken_ranges()
+        
+        ranges = []
+        cur = None
+        for (lower, upper), rows in zip(steps, step_rows):
+            if self.overlapping(taken, num(lower), num(upper)):
+                cur = None
+                continue
+            if cur is None or (cur[2] >= 1 and rows >= 1 and cur[2] + rows > target):
+                cur = [lower, upper, rows]
+                ranges.append(cur)
+            else:
+                cur[1] = upper
+                cur[2] += rows
+        return [(lower, upper) for lower, upper, rows in ranges]
+    
+    def taken_ranges(self):
+        '''
+        A (partition, lower, upper) tuple for each of the parent's range 
+        partitions with the bounds as numbers, upper being None for open
+        ended partitions.
+        '''
+        num = self.calendar.to_number
+        taken = []
+        for partition, lower, upper in self.table_info().partition_bounds:
+            if upper is not None:
+                upper = num(self.parse_range_val(upper))
+            taken.append((partition, num(self.parse_range_val(lower)), upper))
+        return taken
+    
+    def overlapping(self, taken, lower, upper):
         '''
-        Create the child partitions, bails out if it encounters a partition
-        that already exists
+        The partitions in taken whose ranges overlap [lower, upper).
         '''
+        return [t[0] for t in taken if upper > t[1] and (t[2] is None or lower < t[2])]
+    
+    def sample_step_rows(self, steps):
+        '''
+        Estimated rows in each calendar step from a --sample percent 
+        TABLESAMPLE SYSTEM scan, counted server side.
+        '''
+        sample_sql = \
+        '''
+        SELECT width_bucket(%(part_column)s, %%s::text[]::%(col_type)s[]), count(*)
+        FROM ONLY %(table_name)s TABLESAMPLE SYSTEM (%%s)
+        GROUP BY 1;
+        '''
+        
+        if not steps:
+            return []
+        thresholds = [self.calendar.format_val(lower) for lower, upper in steps]
+        thresholds.append(self.calendar.format_val(steps[-1][1]))
+        self.curs.execute(sample_sql % {'part_column': self.part_column, 
+                                        'col_type': self.col_type,
+                                        'table_name': self.qualified_table_name},
+                          (thresholds, self.opts.sample))
+        counts = dict(self.curs.fetchall())
+        scale = 100.0 / self.opts.sample
+        return [counts.get(i + 1, 0) * scale for i in range(len(steps))]
+    
+    def create_partition_sql(self, partition, vals):
         create_part_sql = \
         '''
         CREATE TABLE %s (
             %s
         ) INHERITS (%s);
+        '''
+        create_part_of_sql = \
+        '''
+        CREATE TABLE %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s');
+        '''
+        
+        check_str = self.partition_check(vals)
+        if self.natively_partitioned():
+            sql = create_part_of_sql % (partition, self.qualified_table_name, vals[0], vals[1])
+        else:
+            sql = create_part_sql % (partition, check_str, self.qualified_table_name)
+        return sql + self.register_partition_sql(partition, vals)
+    
+    def partition_check(self, vals):
+        '''
+        The CHECK constraint for a partition with the given vals, as stored
+        in pgpartitioner.partitions.
+        '''
+        if self.partition_type == 'hash':
+            return "CHECK (%s = %s)" % (self.hash_bucket_sql(self.part_column, vals[0]), vals[1])
+        if self.partition_type == 'list':
+            return "CHECK (%s IN (%s))" % (self.part_column, ','.join([quote_literal(v) for v in vals]))
+        # a native partition's constraint rules out NULLs, ATTACH PARTITION
+        # only takes the CHECK constraint's word for it if it says so too
+        if self.native():
+            return "CHECK (%s IS NOT NULL AND %s >= '%s' AND %s < '%s')" % (self.part_column, self.part_column, vals[0],
+                                                                             self.part_column, vals[1])
+        return "CHECK (%s >= '%s' AND %s < '%s')" % (self.part_column, vals[0], self.part_column, vals[1])
+    
+    def hash_bucket_sql(self, col, modulus):
+        '''
+        The hash partition, out of modulus, that col's value belongs in.
+        '''
+        func = hash_func(self.col_type)
+        if not func:
+            raise RuntimeError("%s columns can't be hash partitioned." % self.col_type)
+        return hash_sql % (func % col, modulus)
+    
+    def register_partition_sql(self, partition, vals):
+        register_part_sql = \
+        '''
         INSERT INTO pgpartitioner.partitions
         (partition_oid, parent_oid, partition_type, vals)
         VALUES
-        ('%s'::regclass, '%s'::regclass, 'range', ARRAY[%s])
+        ('%s'::regclass, '%s'::regclass, '%s', ARRAY[%s]);
+        '''
+        
+        vals_str = ','.join([quote_literal(v) for v in vals])
+        return register_part_sql % (partition, self.qualified_table_name, self.partition_type, vals_str)
+        
+    def get_partition_defs(self):
+        '''
+        Returns a (partition, vals) tuple for each partition the options ask
+        for, with vals as they're stored in pgpartitioner.partitions.  For 
+        range and hash partitions these may already exist.
+        '''
+        if self.partition_type == 'hash':
+            modulus = self.opts.modulus
+            for partition, part_type, vals in self.table_info().partition_vals:
+                if int(vals[0]) != modulus:
+                    self.parser.error("%s is already hash partitioned %s ways, its --modulus can't be changed." 
+                                      % (self.qualified_table_name, vals[0]))
+            return [('%s_%d' % (self.qualified_table_name, r), [str(modulus), str(r)]) for r in range(modulus)]
+        if self.partition_type == 'list':
+            return self.get_list_partition_defs()
+        return [(partition, [start, end]) for partition, start, end in self.get_partition_ranges()]
+    
+    def get_list_partition_defs(self):
+        '''
+        List partitions for the --values, or each distinct value in the 
+        table, not already held by a partition.  They're numbered on from 
+        the table's existing partitions.
+        '''
+        distinct_sql = 'SELECT DISTINCT %(part_column)s::text FROM ONLY %(table_name)s WHERE %(part_column)s IS NOT NULL ORDER BY 1;'
+        
+        if self.opts.values:
+            groups = [[v.strip() for v in group.split(',')] for group in self.opts.values.split(';') if group.strip()]
+        else:
+            self.curs.execute(distinct_sql % {'part_column': self.part_column, 'table_name': self.qualified_table_name})
+            groups = [[res[0]] for res in self.curs.fetchall()]
+        
+        info = self.table_info()
+        taken = set([v for partition, part_type, vals in info.partition_vals for v in vals])
+        nums = [int(m.group(1)) for m in [re.search(r'_(\d+)$', partition) for partition in info.partitions] if m]
+        num = max(nums + [-1]) + 1
+        
+        defs = []
+        for group in groups:
+            group = [v for v in group if v not in taken]
+            if not group:
+                continue
+            defs.append(('%s_%d' % (self.qualified_table_name, num), group))
+            taken.update(group)
+            num += 1
+        return defs
+    
+    def build_tables(self):
+        '''
+        Create the child partitions, skipping any that already exist.  All of
+        the boundaries are worked out locally and the DDL is sent in batches
+        of ddl_batch_size partitions.
+        '''
+        new_parts = self.get_partition_defs()
+        existing = existing_tables(self.curs, [part[0] for part in new_parts])
+        taken = self.partition_type == 'range' and self.taken_ranges() or []
+        
+        batch = []
+        for partition, vals in new_parts:
+            if partition in self.partitions or partition in existing:
+                print '%s already exists....' % partition
+                if partition not in self.partitions:
+                    self.partitions.append(partition)
+                continue
+            # e.g. a range --merge'd into a partition named for its start
+            overlaps = taken and self.overlapping(taken, self.calendar.to_number(self.parse_range_val(vals[0])),
+                                                  self.calendar.to_number(self.parse_range_val(vals[1])))
+            if overlaps:
+                print '%s is already covered by %s....' % (partition, overlaps[0])
+                continue
+            
+            print 'Creating %s...' % partition
+            batch.append(self.create_partition_sql(partition, vals))
+            self.partitions.append(partition)
+            
+            if len(batch) == ddl_batch_size:
+                self.curs.execute(''.join(batch))
+                batch = []
+        if batch:
+            self.curs.execute(''.join(batch))
+        self.catalog.invalidate(self.qualified_table_name)
+        self.register_parent()
+        
+        # native partitioning routes rows itself
+        if not self.natively_partitioned():
+            self.load_templated_funcs()
+        # the parent is swapped out at the end of the post stage, route 
+        # inserts from now on so none are left behind in it
+        if self.native() and not self.natively_partitioned():
+            self.set_trigger_func()
+
+    def register_parent(self):
+        '''
+        Records how the parent is partitioned for --maintain to go by.
+        '''
+        register_sql = \
+        '''
+        INSERT INTO pgpartitioner.parents 
+        (parent_oid, part_column, col_type, units, trigger_type, routing, partition_type)
+        VALUES (%s::regclass, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (parent_oid) DO UPDATE
+        SET part_column=EXCLUDED.part_column, col_type=EXCLUDED.col_type, units=EXCLUDED.units,
+            trigger_type=EXCLUDED.trigger_type, routing=EXCLUDED.routing, 
+            partition_type=EXCLUDED.partition_type;
+        '''
+        
+        # units only mean something for range partitions
+        units = self.partition_type == 'range' and self.opts.units or None
+        self.curs.execute(register_sql, (self.qualified_table_name, self.part_column, self.col_type,
+                                         units, self.opts.trigger, self.opts.routing, self.partition_type))
+    
+    def maintain(self):
+        '''
+        Tops up the future partitions of every registered parent, or just
+        the one given, once or, with --interval, forever.  Each parent is
+        committed on its own so one failing doesn't hold up the others.
+        '''
+        parents_sql = \
+        '''
+        SELECT n.nspname || '.' || c.relname, pa.part_column, pa.col_type, pa.units, 
+            pa.trigger_type, pa.routing, pa.partition_type
+        FROM pgpartitioner.parents pa, pg_class c, pg_namespace n
+        WHERE pa.parent_oid=c.oid AND c.relnamespace=n.oid
+        '''
+        unregistered_sql = \
         '''
+        SELECT DISTINCT p.parent_oid::regclass::text
+        FROM pgpartitioner.partitions p
+        WHERE p.parent_oid NOT IN (SELECT parent_oid FROM pgpartitioner.parents)
+        '''
+        
+        params = ()
+        if self.args:
+            parents_sql += ' AND pa.parent_oid=%s::regclass'
+            unregistered_sql += ' AND p.parent_oid=%s::regclass'
+            params = (self.args[0],)
         
-        start, end = (self.opts.start, self.nextInterval(self.opts.start))
-        # print start
         while True:
-            if int(start) > int(self.opts.end):
-                break
+            self.curs.execute(unregistered_sql, params)
+            for res in self.curs.fetchall():
+                print 'Skipping %s, run its create stage once to record how it is partitioned.' % res[0]
+            self.curs.execute(parents_sql, params)
+            parents = self.curs.fetchall()
+            self.catalog.invalidate()
             
-            # if str(end) < self.opts.end:
-            # check_str = "CHECK (%s >= '%s' AND %s < '%s')" % (self.part_column, start, self.part_column, end)
-            # else:
-            #      check_str = "CHECK (%s >= '%s')" % (self.part_column, start)
-                
-            partition = '%s_%s' % (self.qualified_table_name, start)
-            if partition in self.partitions:
+            for parent in parents:
+                try:
+                    self.maintain_parent(*parent)
+                except Exception, e:
+                    print 'Failed to maintain %s: %s' % (parent[0], str(e).strip())
+                    self.con.rollback()
+                    continue
+                if self.opts.test:
+                    self.con.rollback()
+                else:
+                    self.con.commit()
+            
+            if not self.opts.interval:
+                break
+            time.sleep(self.opts.interval)
+    
+    def maintain_parent(self, table, part_column, col_type, units, trigger, routing, partition_type):
+        '''
+        Creates partitions after the parent's newest one until it has 
+        --maintain of them starting after the current time.  Parents with
+        an open ended partition are left be.
+        '''
+        newest_sql = \
+        '''
+        SELECT p.vals[2], (SELECT count(*) 
+                           FROM pgpartitioner.partitions f 
+                           WHERE f.parent_oid=p.parent_oid AND f.vals[1]::%(col_type)s > localtimestamp)
+        FROM pgpartitioner.partitions p
+        WHERE p.parent_oid=%%s::regclass
+        ORDER BY p.vals[2]::%(col_type)s DESC NULLS FIRST
+        LIMIT 1;
+        '''
+        now_sql = "SELECT to_char(localtimestamp, 'YYYYMMDDHH24MISS');"
+        
+        if partition_type != 'range' or not (col_type == 'date' or re.search('time[^\]]*$', col_type)):
+            print 'Skipping %s, only time partitioned tables have partitions for times to come.' % table
+            return
+        
+        self.qualified_table_name = table
+        self.table_name = table.split('.', 1)[1]
+        self.part_column = part_column
+        self.col_type = col_type
+        self.short_type = 'ts'
+        self.calendar = TimestampCalendar(units)
+        self.opts.trigger = trigger
+        self.opts.routing = routing
+        self.partition_type = partition_type
+        
+        self.curs.execute(newest_sql % {'col_type': col_type}, (table,))
+        if not self.curs.rowcount:
+            print 'Skipping %s, it has no partitions to carry on from.' % table
+            return
+        newest, future = self.curs.fetchone()
+        if newest is None:
+            print 'Skipping %s, its newest partition is open ended and already holds the times to come.' % table
+            return
+        self.curs.execute(now_sql)
+        now = self.calendar.parse(self.curs.fetchone()[0])
+        
+        ranges = []
+        lower = self.parse_range_val(newest)
+        while future < self.opts.maintain:
+            upper = self.calendar.next(lower)
+            partition = '%s_%s' % (table, self.calendar.format_name(lower))
+            ranges.append((partition, self.calendar.format_val(lower), self.calendar.format_val(upper)))
+            if lower > now:
+                future += 1
+            lower = upper
+        
+        existing = existing_tables(self.curs, [r[0] for r in ranges])
+        batch = []
+        for partition, start, end in ranges:
+            if partition in existing:
                 print '%s already exists....' % partition
-                start, end = (end, self.nextInterval(end))
                 continue
-                
+            print 'Creating %s...' % partition
+            batch.append(self.create_partition_sql(partition, [start, end]))
+        if not batch:
+            return
+        self.curs.execute(''.join(batch))
+        self.catalog.invalidate(table)
+        
+        # the insert function only needs regenerating when there's a new
+        # partition to route to
+        if not self.native():
+            self.load_templated_funcs()
+    
+    def load_parent(self):
+        '''
+        Sets up for working on the partitions of an already partitioned
+        TABLE: its partition column and how it's routed come from 
+        pgpartitioner.parents, or the column can be given after TABLE.
+        Returns the parent's TableInfo.
+        '''
+        parent_sql = \
+        '''
+        SELECT part_column, col_type, trigger_type, routing, partition_type
+        FROM pgpartitioner.parents 
+        WHERE parent_oid=%s::regclass;
+        '''
+        
+        info = self.catalog.table(self.args[0])
+        self.qualified_table_name = info.name
+        self.table_name = info.name.split('.', 1)[1]
+        self.partition_type = 'range'
+        
+        self.curs.execute(parent_sql, (self.qualified_table_name,))
+        res = self.curs.fetchone()
+        if res and res[4] != 'range':
+            self.parser.error("%s is %s partitioned, only range partitions can be expired, merged or split." 
+                              % (self.qualified_table_name, res[4]))
+        if res:
+            self.part_column, self.col_type, self.opts.trigger, self.opts.routing = res[:4]
+        elif len(self.args) > 1 and self.args[1] in info.column_types:
+            self.part_column, self.col_type = self.args[1], info.column_types[self.args[1]]
+        else:
+            self.parser.error("%s's partition column isn't recorded, give it after the table name." 
+                              % self.qualified_table_name)
+        self.short_type = re.search('int[^\]]*$', self.col_type) and 'int' or 'ts'
+        # for reading and comparing bounds, --split sets the interval it needs
+        self.calendar = self.short_type == 'ts' and TimestampCalendar('1 day') or IntegerCalendar(1)
+        return info
+    
+    def expire(self):
+        '''
+        Archives and then drops, or detaches, the partitions whose ranges end
+        on or before --expire, over a pool of --jobs connections.  They're
+        unregistered, which the dynamic insert function goes by, and the 
+        static insert function is regenerated without them, all committed
+        first to stop routing to them, so inserts for their ranges fall 
+        back on the parent rather than failing once they're gone.  Each 
+        partition is then archived and dropped in one transaction with 
+        writes to it blocked from the start so nothing written to it can 
+        be missed by the archive.  Its manifest entry is only written once
+        that's committed, and if any fail those not yet expired are 
+        registered again.  Test runs archive to a temporary directory 
+        that's removed afterwards.
+        '''
+        expired_sql = \
+        '''
+        SELECT n.nspname || '.' || c.relname, p.vals[1], p.vals[2]
+        FROM pgpartitioner.partitions p, pg_class c, pg_namespace n
+        WHERE p.parent_oid=%%s::regclass AND p.partition_oid=c.oid AND c.relnamespace=n.oid
+            AND p.vals[2]::%(col_type)s <= %(cutoff)s
+        ORDER BY p.vals[2]::%(col_type)s;
+        '''
+        
+        info = self.load_parent()
+        
+        cutoff = '%s::%s' % (quote_literal(self.opts.expire), self.col_type)
+        if self.short_type == 'ts':
             try:
-                self.curs.execute('SAVEPOINT create_table_save;')
-                    
-                check_str = "CHECK (%s >= '%s' AND %s < '%s')" % (self.part_column, start, self.part_column, end)
-                vals_str = "'%s','%s'" % (start, end)
-                print 'Creating %s...' % partition
-                self.curs.execute(create_part_sql % 
-                        (partition, check_str, self.qualified_table_name, partition, self.qualified_table_name, vals_str))
-            except psycopg2.ProgrammingError, e:
-                if e.pgerror.strip().endswith('already exists'):
-                    self.curs.execute('ROLLBACK TO SAVEPOINT create_table_save;')
+                parse_interval(self.opts.expire)
+                cutoff = '(localtimestamp - %s::interval)::%s' % (quote_literal(self.opts.expire), self.col_type)
+            except ValueError:
+                pass
+        self.curs.execute(expired_sql % {'col_type': self.col_type, 'cutoff': cutoff}, 
+                          (self.qualified_table_name,))
+        expired = self.curs.fetchall()
+        if not expired:
+            print 'No partitions of %s end on or before %s.' % (self.qualified_table_name, self.opts.expire)
+            return
+        
+        archive_dir = self.opts.archive_dir
+        if self.opts.test:
+            archive_dir = tempfile.mkdtemp()
+        elif not os.path.isdir(archive_dir):
+            os.makedirs(archive_dir)
+        atts = ','.join(info.attributes)
+        native = self.natively_partitioned()
+        manifest_lock = threading.Lock()
+        
+        def expire_partition(curs, item):
+            partition, lower, upper = item
+            path = os.path.join(archive_dir, '%s.copy.gz' % partition)
+            curs.execute('LOCK TABLE %s IN SHARE MODE;' % partition)
+            rows, checksum, size = copy_to_archive(curs, 'COPY %s (%s) TO STDOUT;' % (partition, atts), path)
             
-            start, end = (end, self.nextInterval(end))
-            self.partitions.append(partition)
+            if not self.opts.detach:
+                curs.execute('DROP TABLE %s;' % partition)
+            elif native:
+                curs.execute('ALTER TABLE %s DETACH PARTITION %s;' % (self.qualified_table_name, partition))
+            else:
+                curs.execute('ALTER TABLE %s NO INHERIT %s;' % (partition, self.qualified_table_name))
+            if not self.opts.test:
+                curs.connection.commit()
             
-        self.load_templated_funcs()
-
-    def get_indexdefs_str(self):
-        idxs_sql = ''
-        idx_count = 0
+            manifest_lock.acquire()
+            try:
+                expired_parts.add(partition)
+                write_manifest(archive_dir, 
+                               {'file': os.path.basename(path), 'sha256': checksum, 'bytes': size,
+                                'rows': rows, 'table': self.qualified_table_name, 'partition': partition,
+                                'columns': list(info.attributes), 'part_column': self.part_column,
+                                'lower': lower, 'upper': upper, 'dropped': not self.opts.detach,
+                                'archived': time.strftime('%Y-%m-%dT%H:%M:%S')})
+            finally:
+                manifest_lock.release()
+            print 'Archived %d rows of %s to %s and %s it.' % (rows, partition, path, 
+                                                                self.opts.detach and 'detached' or 'dropped')
+        
+        expiring = [part[0] for part in expired]
+        self.curs.execute('DELETE FROM pgpartitioner.partitions WHERE partition_oid = ANY(%s::regclass[]::oid[]);', 
+                          (expiring,))
+        if not native:
+            self.load_templated_funcs([b for b in info.partition_bounds if b[0] not in expiring])
+        if not self.opts.test:
+            self.con.commit()
+        expired_parts = set()
+        try:
+            self.run_workers(self.opts.jobs, expired, expire_partition)
+        except Exception:
+            if not self.opts.test:
+                self.reregister([part for part in expired if part[0] not in expired_parts])
+            raise
+        finally:
+            if self.opts.test:
+                shutil.rmtree(archive_dir)
+        self.catalog.invalidate(self.qualified_table_name)
+    
+    def reregister(self, parts):
+        '''
+        Registers the (partition, lower, upper) parts again after --expire
+        failed to expire them, and routes to them again, committing it.
+        '''
+        self.con.rollback()
+        for partition, lower, upper in parts:
+            self.curs.execute(self.register_partition_sql(partition, [lower, upper]))
+        self.catalog.invalidate(self.qualified_table_name)
+        if not self.natively_partitioned():
+            self.load_templated_funcs()
+        self.con.commit()
+        print 'Registered %d partitions of %s that were not expired again.' % (len(parts), self.qualified_table_name)
+    
+    def merge(self):
+        '''
+        Combines the adjacent partitions within the --merge range into one.
+        Everything happens in one transaction: the partitions are locked
+        against writes, their rows are copied, in partition column order,
+        into a new table outside of the parent which is then indexed, and
+        only then are they locked exclusively to be dropped and the new 
+        table put in their place.
+        '''
+        merging_sql = \
+        '''
+        SELECT n.nspname || '.' || c.relname, p.vals[1], p.vals[2],
+            p.vals[2]::%(col_type)s = lead(p.vals[1]) OVER (ORDER BY p.vals[1]::%(col_type)s)::%(col_type)s
+        FROM pgpartitioner.partitions p, pg_class c, pg_namespace n
+        WHERE p.parent_oid=%%s::regclass AND p.partition_oid=c.oid AND c.relnamespace=n.oid
+            AND p.vals[1]::%(col_type)s >= %%s::%(col_type)s AND p.vals[2]::%(col_type)s <= %%s::%(col_type)s
+        ORDER BY p.vals[1]::%(col_type)s;
+        '''
+        fill_sql = 'INSERT INTO %s (%s) SELECT %s FROM ONLY %s ORDER BY %s;'
+        
+        info = self.load_parent()
+        lower, upper = self.opts.merge
+        self.curs.execute(merging_sql % {'col_type': self.col_type}, (self.qualified_table_name, lower, upper))
+        merging = self.curs.fetchall()
+        if len(merging) < 2:
+            self.parser.error("%s doesn't have two or more partitions within [%s, %s) to merge." 
+                              % (self.qualified_table_name, lower, upper))
+        gaps = [part[0] for part in merging[:-1] if not part[3]]
+        if gaps:
+            self.parser.error("The partitions of %s within [%s, %s) aren't adjacent, there's a gap after %s." 
+                              % (self.qualified_table_name, lower, upper, gaps[0]))
+        
+        old_parts = [part[0] for part in merging]
+        partition, start, end = old_parts[0], merging[0][1], merging[-1][2]
+        new_partition = self.staging_name(partition)
+        atts = ','.join(info.attributes)
+        
+        self.curs.execute('LOCK TABLE %s IN SHARE MODE;' % ', '.join(old_parts))
+        print 'Creating %s for [%s, %s)...' % (new_partition, start, end)
+        self.create_staging_partition(self.curs, new_partition, start, end)
+        for part in old_parts:
+            self.curs.execute(fill_sql % (new_partition, atts, atts, part, self.part_column))
+            print 'Copied %d rows from %s.' % (self.curs.rowcount, part)
+        for sql in self.staging_index_sql(new_partition):
+            self.build_staging_index(self.curs, sql)
+        
+        self.swap_partitions(old_parts, [(new_partition, partition, start, end)])
+        print 'Merged %d partitions of %s into %s.' % (len(old_parts), self.qualified_table_name, partition)
+    
+    def split(self):
+        '''
+        Divides the --split partition into partitions of --units * --scale.
+        The old partition is locked against writes throughout and read once,
+        each row being inserted into its new partition by a generated route
+        function.  With --jobs the new partitions are filled and committed
+        over a connection of their own, while this one keeps the lock, so 
+        their indexes can be built in parallel before they're swapped in.
+        '''
+        split_sql = \
+        '''
+        SELECT n.nspname || '.' || c.relname, p.vals[1], p.vals[2]
+        FROM pgpartitioner.partitions p, pg_class c, pg_namespace n
+        WHERE p.partition_oid=%s::regclass AND p.parent_oid=%s::regclass 
+            AND p.partition_oid=c.oid AND c.relnamespace=n.oid;
+        '''
+        
+        info = self.load_parent()
+        self.curs.execute(split_sql, (self.opts.split, self.qualified_table_name))
+        if not self.curs.rowcount:
+            self.parser.error("%s isn't a partition of %s." % (self.opts.split, self.qualified_table_name))
+        partition, start, end = self.curs.fetchone()
+        if end is None:
+            self.parser.error("%s is open ended, it can't be split." % partition)
+        
+        try:
+            if self.short_type == 'ts':
+                self.opts.units = '%d %s' % (self.opts.scale, self.opts.units)
+                self.calendar = TimestampCalendar(self.opts.units)
+            else:
+                self.opts.units = str(self.opts.scale * int(self.opts.units))
+                self.calendar = IntegerCalendar(self.opts.units)
+        except ValueError, e:
+            self.parser.error(str(e))
+        lower, upper = self.parse_range_val(start), self.parse_range_val(end)
+        bounds = [(l, min(u, upper)) for l, u in self.calendar.bounds(lower, upper) if l < upper]
+        if len(bounds) < 2:
+            self.parser.error("[%s, %s) of %s is no more than %s, there's nothing to split." 
+                              % (start, end, partition, self.opts.units))
+        
+        staged = []
+        for l, u in bounds:
+            new_partition = '%s_%s' % (self.qualified_table_name, self.calendar.format_name(l))
+            staged.append((self.staging_name(new_partition), new_partition, 
+                           self.calendar.format_val(l), self.calendar.format_val(u)))
+        existing = existing_tables(self.curs, [s[1] for s in staged if s[1] != partition] + [s[0] for s in staged])
+        if existing:
+            self.parser.error("%s already exists." % sorted(existing)[0])
+        
+        self.curs.execute('LOCK TABLE %s IN SHARE MODE;' % partition)
+        parallel = self.opts.jobs > 1
+        if parallel and self.opts.test:
+            print 'Test runs can not be split across transactions, building indexes serially.'
+            parallel = False
+        
+        work = []
+        for staging, new_partition, s, e in staged:
+            print 'Creating %s for [%s, %s)...' % (new_partition, s, e)
+            work += self.staging_index_sql(staging)
+        
+        if not parallel:
+            self.fill_split(self.curs, partition, staged)
+            for sql in work:
+                self.build_staging_index(self.curs, sql)
+        else:
+            fill_con = self.get_connection()
+            try:
+                self.fill_split(fill_con.cursor(), partition, staged)
+                fill_con.commit()
+            finally:
+                fill_con.close()
+            try:
+                self.run_workers(self.opts.jobs, work, self.build_staging_index)
+            except Exception:
+                # the new partitions were committed, don't leave them behind
+                self.con.rollback()
+                self.curs.execute('DROP TABLE IF EXISTS %s;' % ', '.join([s[0] for s in staged]))
+                self.con.commit()
+                raise
+        
+        self.swap_partitions([partition], staged)
+        print 'Split %s into %d partitions.' % (partition, len(staged))
+    
+    def fill_split(self, curs, partition, staged):
+        '''
+        Creates the staging partitions for a split and fills them from one
+        scan of partition with a route function generated for them.  Fails
+        if any rows, e.g. with a NULL partition column, have nowhere to go.
+        '''
+        fill_sql = \
+        '''
+        SELECT count(*) FILTER (WHERE routed), count(*) FILTER (WHERE NOT routed)
+        FROM (SELECT %(partition)s_route(p) AS routed FROM ONLY %(partition)s p) r;
+        '''
+        
+        for staging, new_partition, start, end in staged:
+            self.create_staging_partition(curs, staging, start, end)
+        bounds = [(staging, start, end) for staging, new_partition, start, end in staged]
+        d = {'table_name': partition,
+             'routing_tree': self.get_static_routing_tree(self.table_info().attributes, 'RETURN TRUE;', bounds)
+        }
+        curs.execute(self.read_file('range_part_route.tpl.sql') % d)
+        curs.execute(fill_sql % {'partition': partition})
+        routed, unrouted = curs.fetchone()
+        if unrouted:
+            raise RuntimeError("%d rows of %s are outside of its bounds, they'd be lost splitting it." 
+                               % (unrouted, partition))
+        curs.execute('DROP FUNCTION %s_route(%s);' % (partition, partition))
+        print 'Copied %d rows from %s.' % (routed, partition)
+    
+    def staging_name(self, partition):
+        '''
+        The name a partition is built under until it's swapped in.
+        '''
+        return partition + '_new'
+    
+    def create_staging_partition(self, curs, partition, start, end):
+        '''
+        Creates a partition for [start, end) as a table of its own, copying
+        the parent's columns, defaults and CHECK constraints, so it can be 
+        filled and indexed before it's made part of the parent.
+        '''
+        create_sql = \
+        '''
+        CREATE TABLE %s (
+            LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+            %s
+        );
+        '''
+        
+        curs.execute(create_sql % (partition, self.qualified_table_name, self.partition_check([start, end])))
+    
+    def staging_index_sql(self, partition):
+        '''
+        The statements building the parent's indexes, and its constraints 
+        other than the CHECK constraints it already has, on a staging
+        partition.
+        '''
+        partition_point = partition[len(self.qualified_table_name) + 1:]
+        stmts = [idx % (partition_point, partition_point) + ';' for idx in self.get_indexdefs()]
+        for contype, condef in self.table_info().constraints:
+            if contype == 'c' or (contype == 'f' and not self.opts.fkeys):
+                continue
+            stmts.append('ALTER TABLE %s ADD %s;' % (partition, condef))
+        return stmts
+    
+    def build_staging_index(self, curs, sql):
+        if self.opts.maintenance_work_mem:
+            curs.execute('SET LOCAL maintenance_work_mem = %s;', (self.opts.maintenance_work_mem,))
+        curs.execute(sql)
+    
+    def swap_partitions(self, old_parts, new_parts):
+        '''
+        Drops old_parts and puts the staging partitions of new_parts, a list
+        of (staging name, name, start, end) tuples, in their place: each one
+        joins the parent, is registered and takes its name, with its indexes
+        and constraints renamed to match.  The old partitions are only 
+        locked exclusively from here to the end of the transaction.  The 
+        insert function is regenerated afterwards.
+        '''
+        renames_sql = \
+        '''
+        SELECT 'CONSTRAINT', conname::text FROM pg_constraint WHERE conrelid=%(partition)s::regclass
+        UNION ALL
+        SELECT 'INDEX', c.relname::text 
+        FROM pg_index i, pg_class c 
+        WHERE i.indrelid=%(partition)s::regclass AND i.indexrelid=c.oid
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint co WHERE co.conindid=c.oid);
+        '''
+        
+        native = self.natively_partitioned()
+        self.curs.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE;' % ', '.join(old_parts))
+        self.curs.execute('DELETE FROM pgpartitioner.partitions WHERE partition_oid = ANY(%s::regclass[]::oid[]);', 
+                          (old_parts,))
+        for part in old_parts:
+            self.curs.execute('DROP TABLE %s;' % part)
+        
+        for staging, partition, start, end in new_parts:
+            if native:
+                self.curs.execute("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%s) TO (%s);" 
+                                  % (self.qualified_table_name, staging, quote_literal(start), quote_literal(end)))
+            else:
+                self.curs.execute('ALTER TABLE %s INHERIT %s;' % (staging, self.qualified_table_name))
+            self.curs.execute(self.register_partition_sql(staging, [start, end]))
+            
+            # the index and constraint names all start with the table's
+            staging_base, base = staging.split('.', 1)[1], partition.split('.', 1)[1]
+            self.curs.execute(renames_sql, {'partition': staging})
+            renames = self.curs.fetchall()
+            self.curs.execute('ALTER TABLE %s RENAME TO %s;' % (staging, base))
+            for kind, name in renames:
+                if not name.startswith(staging_base):
+                    continue
+                new_name = base + name[len(staging_base):]
+                if kind == 'CONSTRAINT':
+                    self.curs.execute('ALTER TABLE %s RENAME CONSTRAINT %s TO %s;' % (partition, name, new_name))
+                else:
+                    self.curs.execute('ALTER INDEX %s.%s RENAME TO %s;' 
+                                      % (partition.split('.', 1)[0], name, new_name))
+        
+        self.catalog.invalidate(self.qualified_table_name)
+        if not native:
+            self.load_templated_funcs()
+    
+    def get_column_stats(self):
+        '''
+        Loads the parent's size and the partition column's distribution from
+        pg_class and pg_stats, with values as numbers for estimating.
+        '''
+        stats_sql = \
+        '''
+        SELECT c.reltuples, c.relpages, current_setting('block_size')::integer, s.null_frac,
+            ARRAY(SELECT %(to_num)s FROM unnest(s.histogram_bounds::text::text[]) v),
+            ARRAY(SELECT %(to_num)s FROM unnest(s.most_common_vals::text::text[]) v),
+            s.most_common_freqs
+        FROM pg_class c
+            LEFT JOIN pg_stats s ON s.schemaname=%%s AND s.tablename=%%s AND s.attname=%%s 
+                AND NOT s.inherited
+        WHERE c.oid=%%s::regclass;
+        '''
+        
+        if self.short_type == 'ts':
+            to_num = 'extract(epoch FROM v::timestamp)'
+        else:
+            to_num = 'v::numeric'
+        schema, table = self.qualified_table_name.split('.', 1)
+        self.curs.execute(stats_sql % {'to_num': to_num}, 
+                          (schema, table, self.part_column, self.qualified_table_name))
+        return ColumnStats(*self.curs.fetchone())
+    
+    def plan(self):
+        '''
+        Prints what the selected stages would do with row, size and time 
+        estimates from the parent's statistics.  Nothing is scanned or 
+        changed.
+        '''
+        stats = self.get_column_stats()
+        info = self.table_info()
+        jobs = self.opts.jobs
+        
+        print 'Plan for %s on %s (%s):' % (self.qualified_table_name, self.part_column, self.col_type)
+        print '  ~%d rows, %s in the parent' % (stats.reltuples, format_bytes(stats.relpages * stats.block_size))
+        if not stats.analyzed():
+            print '  WARNING: %s has no statistics for %s, run ANALYZE for row estimates.' % \
+                    (self.qualified_table_name, self.part_column)
+        
+        parts = [(partition, lower, upper, False) for partition, lower, upper in info.partition_bounds]
+        new_parts = []
+        if self.run_stage('create'):
+            ranges = [r for r in self.get_partition_ranges() if r[0] not in info.partitions]
+            existing = existing_tables(self.curs, [r[0] for r in ranges])
+            num = lambda val: self.calendar.to_number(self.parse_range_val(val))
+            taken = self.taken_ranges()
+            new_parts = [r for r in ranges if r[0] not in existing and not self.overlapping(taken, num(r[1]), num(r[2]))]
+            parts += [(partition, lower, upper, True) for partition, lower, upper in new_parts]
+        parts.sort(key=lambda p: self.bound_key(p[1]))
+        
+        print '\nPartitions:'
+        total_rows = total_bytes = 0
+        part_bytes = {}
+        for partition, lower, upper, new in parts:
+            lower_num = self.calendar.to_number(self.parse_range_val(lower))
+            upper_num = None
+            if upper is not None:
+                upper_num = self.calendar.to_number(self.parse_range_val(upper))
+            rows = stats.range_rows(lower_num, upper_num)
+            part_bytes[partition] = rows * stats.row_width()
+            total_rows += rows
+            total_bytes += part_bytes[partition]
+            print '  %-40s [%s, %s)  %-6s ~%d rows, ~%s' % (partition, lower, upper, new and 'create' or 'exists',
+                                                           rows, format_bytes(part_bytes[partition]))
+        
+        times = []
+        if self.run_stage('create'):
+            print '\nDDL:'
+            for partition, start, end in new_parts:
+                print self.create_partition_sql(partition, [start, end]).rstrip()
+            times.append(('create', len(new_parts) / float(plan_rates['create'])))
+        
+        if self.run_stage('migrate'):
+            migrate_jobs = self.opts.strategy != 'single-pass' and jobs or 1
+            print '\nMigrate: ~%d rows, ~%s with the %s strategy over %d connection(s).' % \
+                    (total_rows, format_bytes(total_bytes), self.opts.strategy, migrate_jobs)
+            rate = float(plan_rates[self.opts.strategy] * migrate_jobs)
+            if self.opts.max_rate:
+                rate = min(rate, self.opts.max_rate)
+            times.append(('migrate', total_rows / rate))
+        
+        if self.run_stage('post'):
+            idxs = self.get_indexdefs()
+            constraints = self.get_constraintdefs()
+            partition_point_re = re.compile(r'%s_(\d*)' % self.table_name)
+            print '\nIndexes and constraints:'
+            for partition, lower, upper, new in parts:
+                partition_point = partition_point_re.search(partition).groups(1)[0]
+                for idx in idxs:
+                    print '  %s;' % (idx % (partition_point, partition_point))
+                for con in constraints:
+                    print '  %s' % (con % (partition_point,))
+            # unique and primary key constraints get built as indexes too
+            nidxs = len(idxs) + len([c for c in info.constraints if c[0] in ('p', 'u')])
+            times.append(('post', total_bytes * nidxs / float(plan_rates['index'] * jobs)))
+        
+        print '\nEstimated time:'
+        for stage, secs in times:
+            print '  %-8s ~%s' % (stage, format_duration(secs))
+        print '  %-8s ~%s' % ('total', format_duration(sum([t[1] for t in times])))
+    
+    def get_indexdefs(self):
+        '''
+        Returns the parent's index definitions, minus unique and primary
+        key indexes, each with two %s placeholders for a partition point:
+        one in the index name and one in the table name.
+        '''
+        idxs = []
         idx_re = re.compile(r'(create (?:unique )?index )(.*)', re.I)
-        for idx in get_index_defs(self.curs, self.qualified_table_name):
+        for idx in self.table_info().index_defs:
             if 'unique' in idx.lower() or 'primary' in idx.lower():
                 continue # we let constraint creation handle unique and primary keys
-            idx_count += 1
             if idx.count(self.table_name) == 1: 
                 idx = re.sub(idx_re, r'\1%s_%%s_\2' % self.table_name, idx)
             else:
@@ -217,8 +1275,12 @@ class DatePartitioner(DBScript):
                 idx = idx[:i]+'_%s'+idx[i:]
             i = idx.rfind(self.table_name) + len(self.table_name)
             idx = idx[:i]+'_%s'+idx[i:]
-            idxs_sql += idx+';'
-        return idxs_sql, idx_count
+            idxs.append(idx)
+        return idxs
+    
+    def get_indexdefs_str(self):
+        idxs = self.get_indexdefs()
+        return ''.join([idx+';' for idx in idxs]), len(idxs)
     
     def build_indexes(self):
         if not self.partitions:
@@ -239,9 +1301,58 @@ class DatePartitioner(DBScript):
                     if e.pgerror.strip().endswith('already exists'):
                         self.curs.execute('ROLLBACK TO SAVEPOINT idx_create_save')
 
+    def build_indexes_parallel(self):
+        '''
+        Builds the partitions' indexes over a pool of --jobs connections,
+        biggest partitions first so the run doesn't finish waiting on one
+        big build.  Each partition's indexes are all built by the one 
+        worker: CREATE INDEX CONCURRENTLY locks its table against the 
+        others so workers on the same partition would only queue up behind
+        each other.  Everything up to here gets committed first so that 
+        the workers can see the partitions.
+        '''
+        sizes_sql = \
+        '''
+        SELECT p.part
+        FROM unnest(%s::text[]) p(part)
+        ORDER BY pg_relation_size(p.part::regclass) DESC;
+        '''
+        concurrently_re = re.compile(r'^(create (?:unique )?index )', re.I)
+        partition_point_re = re.compile(r'%s_(\d*)' % self.table_name)
+        
+        idxs = self.get_indexdefs()
+        if not idxs:
+            return
+        self.curs.execute(sizes_sql, (self.partitions,))
+        work = [res[0] for res in self.curs.fetchall()]
+        self.con.commit()
+        
+        def build_partition_indexes(curs, part):
+            partition_point = partition_point_re.search(part).groups(1)[0]
+            # CREATE INDEX CONCURRENTLY can't be run inside a transaction
+            curs.connection.autocommit = self.opts.concurrently
+            if self.opts.maintenance_work_mem:
+                curs.execute('SET maintenance_work_mem = %s;', (self.opts.maintenance_work_mem,))
+            for idx in idxs:
+                idx = idx % (partition_point, partition_point)
+                if self.opts.concurrently:
+                    idx = concurrently_re.sub(r'\1CONCURRENTLY ', idx)
+                try:
+                    curs.execute(idx)
+                except psycopg2.ProgrammingError, e:
+                    if not e.pgerror.strip().endswith('already exists'):
+                        raise
+                    curs.connection.rollback()
+                    continue
+                # one index already there mustn't roll back the others
+                if not self.opts.concurrently:
+                    curs.connection.commit()
+        
+        self.run_workers(self.opts.jobs, work, build_partition_indexes)
+    
     def get_constraintdefs(self):
         constraints = []
-        for constraint_def in get_constraint_defs(self.curs, self.qualified_table_name, self.opts.fkeys):
+        for constraint_def in self.table_info().get_constraint_defs(self.opts.fkeys):
             constraints.append('ALTER TABLE %s_%%s ADD %s;' % (self.qualified_table_name, constraint_def))
 
         return constraints
@@ -279,17 +1390,192 @@ class DatePartitioner(DBScript):
         if self.table_has_partition_trig():
             return
             
-        part_trig_sql = \
-        '''
-        CREATE TRIGGER %(base_table_name)s_partition_trigger BEFORE INSERT OR UPDATE
-            ON %(table_name)s FOR EACH ROW
-            EXECUTE PROCEDURE %(table_name)s_ins_trig();
-        '''
+        if self.opts.routing == 'statement':
+            part_trig_sql = \
+            '''
+            CREATE TRIGGER %(base_table_name)s_partition_trigger AFTER INSERT
+                ON %(table_name)s REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE %(table_name)s_stmt_trig();
+            '''
+        else:
+            part_trig_sql = \
+            '''
+            CREATE TRIGGER %(base_table_name)s_partition_trigger BEFORE INSERT OR UPDATE
+                ON %(table_name)s FOR EACH ROW
+                EXECUTE PROCEDURE %(table_name)s_ins_trig();
+            '''
         
         d = {'table_name': self.qualified_table_name,
              'base_table_name': self.table_name,
         }
         self.curs.execute(part_trig_sql % d)
+        self.catalog.invalidate(self.qualified_table_name)
+    
+    def check_native_swap(self):
+        '''
+        Refuses to go on with --backend native if the parent has anything
+        attach_native() can't carry over to the new table, which would be
+        left behind on TABLE_unpartitioned.
+        '''
+        left_behind_sql = \
+        '''
+        SELECT DISTINCT CASE v.relkind WHEN 'm' THEN 'materialized view ' ELSE 'view ' END || v.oid::regclass::text
+        FROM pg_depend d, pg_rewrite r, pg_class v
+        WHERE d.refclassid='pg_class'::regclass AND d.refobjid=%(oid)s 
+            AND d.classid='pg_rewrite'::regclass AND d.objid=r.oid AND r.ev_class=v.oid AND v.oid != %(oid)s
+        UNION ALL
+        SELECT 'rule ' || r.rulename FROM pg_rewrite r WHERE r.ev_class=%(oid)s
+        UNION ALL
+        SELECT 'foreign key ' || c.conname || ' on ' || c.conrelid::regclass::text
+        FROM pg_constraint c 
+        WHERE c.confrelid=%(oid)s AND c.contype='f'
+        UNION ALL
+        SELECT 'trigger ' || t.tgname 
+        FROM pg_trigger t 
+        WHERE t.tgrelid=%(oid)s AND NOT t.tgisinternal AND t.tgname != %(trigger)s
+        UNION ALL
+        SELECT 'policy ' || p.polname FROM pg_policy p WHERE p.polrelid=%(oid)s
+        UNION ALL
+        SELECT CASE WHEN a.attidentity != '' THEN 'identity column ' ELSE 'privileges on column ' END || a.attname
+        FROM pg_attribute a
+        WHERE a.attrelid=%(oid)s AND a.attnum > 0 AND NOT a.attisdropped 
+            AND (a.attidentity != '' OR a.attacl IS NOT NULL);
+        '''
+        
+        self.curs.execute(left_behind_sql, {'oid': self.table_info().oid, 
+                                            'trigger': '%s_partition_trigger' % self.table_name})
+        left_behind = [res[0] for res in self.curs.fetchall()]
+        if left_behind:
+            raise RuntimeError("%s can't be swapped for a natively partitioned table, these would be left on %s_unpartitioned: %s."
+                               % (self.qualified_table_name, self.qualified_table_name, ', '.join(left_behind)))
+    
+    def attach_native(self):
+        '''
+        Swaps the parent for a PARTITION BY RANGE table of the same name with
+        the partitions moved over to it from the parent.  The parent is 
+        locked for the swap and anything written to it since the migration
+        that has a partition is moved first.  Each partition's CHECK 
+        constraint proves its range, NOT NULL included, so ATTACH 
+        PARTITION doesn't scan it and, as the partitions are already 
+        indexed, the parent's indexes and constraints are recreated on 
+        the new table by attaching theirs rather than building new ones.
+        The new table gets the parent's columns, defaults, CHECK 
+        constraints, comments, owner and grants too, check_native_swap()
+        having made sure there's nothing else.  The old parent is kept, 
+        renamed, with anything left in it and without its trigger.
+        '''
+        native_sql = \
+        '''
+        CREATE TABLE %s_native (
+            LIKE %s INCLUDING ALL EXCLUDING INDEXES EXCLUDING IDENTITY
+        ) PARTITION BY RANGE (%s);
+        '''
+        attach_sql = \
+        '''
+        ALTER TABLE %s NO INHERIT %s;
+        ALTER TABLE %s_native ATTACH PARTITION %s FOR VALUES FROM (%s) TO (%s);
+        '''
+        drop_funcs_sql = \
+        '''
+        DROP FUNCTION IF EXISTS %(table_name)s_ins_trig(), %(table_name)s_stmt_trig() CASCADE;
+        DROP FUNCTION IF EXISTS %(table_name)s_ins_func(%(table_name)s), %(table_name)s_route(%(table_name)s),
+            %(table_name)s_routable(%(table_name)s);
+        '''
+        owned_seqs_sql = \
+        '''
+        SELECT s.oid::regclass::text, a.attname
+        FROM pg_depend d, pg_class s, pg_attribute a
+        WHERE d.refobjid=%s::regclass AND d.classid='pg_class'::regclass AND d.deptype='a'
+            AND d.objid=s.oid AND s.relkind='S'
+            AND a.attrelid=d.refobjid AND a.attnum=d.refobjsubid;
+        '''
+        # indexes backing constraints come with the constraints
+        index_defs_sql = \
+        '''
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid=%s::regclass 
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint co WHERE co.conindid=i.indexrelid)
+        ORDER BY i.indexrelid;
+        '''
+        table_sql = \
+        '''
+        SELECT quote_ident(pg_get_userbyid(c.relowner)), obj_description(c.oid, 'pg_class')
+        FROM pg_class c
+        WHERE c.oid=%s::regclass;
+        '''
+        grants_sql = \
+        '''
+        SELECT a.privilege_type, CASE a.grantee WHEN 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END,
+            a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid=%s::regclass;
+        '''
+        swap_sql = \
+        '''
+        ALTER TABLE %(table_name)s RENAME TO %(base_table_name)s_unpartitioned;
+        ALTER TABLE %(table_name)s_native RENAME TO %(base_table_name)s;
+        UPDATE pgpartitioner.partitions SET parent_oid=%%s::regclass WHERE parent_oid=%%s;
+        UPDATE pgpartitioner.parents SET parent_oid=%%s::regclass WHERE parent_oid=%%s;
+        '''
+        idx_name_re = re.compile(r'^(create (?:unique )?index )\S+ (on )', re.I)
+        
+        info = self.table_info()
+        self.curs.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE;' % self.qualified_table_name)
+        moved = self.migrate_single_pass()
+        if moved:
+            print 'Moved %d rows written to %s since its migration.' % (moved, self.qualified_table_name)
+        self.curs.execute(drop_funcs_sql % {'table_name': self.qualified_table_name})
+        
+        self.curs.execute(native_sql % (self.qualified_table_name, self.qualified_table_name, self.part_column))
+        for partition, lower, upper in info.partition_bounds:
+            self.curs.execute(attach_sql % (partition, self.qualified_table_name, 
+                                            self.qualified_table_name, partition, quote_literal(lower),
+                                            upper is None and 'MAXVALUE' or quote_literal(upper)))
+        
+        self.curs.execute(owned_seqs_sql, (self.qualified_table_name,))
+        owned_seqs = self.curs.fetchall()
+        self.curs.execute(index_defs_sql, (self.qualified_table_name,))
+        index_defs = [res[0] for res in self.curs.fetchall()]
+        self.curs.execute(table_sql, (self.qualified_table_name,))
+        owner, comment = self.curs.fetchone()
+        self.curs.execute(grants_sql, (self.qualified_table_name,))
+        grants = self.curs.fetchall()
+        self.curs.execute(swap_sql % {'table_name': self.qualified_table_name,
+                                      'base_table_name': self.table_name},
+                          (self.qualified_table_name, info.oid) * 2)
+        # the sequences would go with the old parent if it's dropped
+        for seq, att in owned_seqs:
+            self.curs.execute('ALTER SEQUENCE %s OWNED BY %s.%s;' % (seq, self.qualified_table_name, att))
+        
+        self.curs.execute('ALTER TABLE %s OWNER TO %s;' % (self.qualified_table_name, owner))
+        if comment is not None:
+            self.curs.execute('COMMENT ON TABLE %s IS %%s;' % self.qualified_table_name, (comment,))
+        for privilege, grantee, grantable in grants:
+            self.curs.execute('GRANT %s ON %s TO %s%s;' % (privilege, self.qualified_table_name, grantee,
+                                                           grantable and ' WITH GRANT OPTION' or ''))
+        
+        # the index definitions name the parent, which is now the new table
+        stmts = [idx_name_re.sub(r'\1\2', idx) for idx in index_defs]
+        stmts += ['ALTER TABLE %s ADD %s;' % (self.qualified_table_name, condef) 
+                  for contype, condef in info.constraints if contype in ('p', 'u', 'f')]
+        for sql in stmts:
+            self.curs.execute('SAVEPOINT native_idx_save;')
+            try:
+                self.curs.execute(sql)
+            except psycopg2.DatabaseError, e:
+                # unique indexes and constraints not including the partition
+                # column can't be made on a partitioned table, the partitions
+                # still have them
+                print 'Skipping %s: %s' % (sql, e.pgerror.strip())
+                self.curs.execute('ROLLBACK TO SAVEPOINT native_idx_save;')
+        
+        self.curs.execute('SELECT EXISTS (SELECT 1 FROM %s_unpartitioned);' % self.qualified_table_name)
+        if self.curs.fetchone()[0]:
+            print 'Rows with no partition to go to were left in %s_unpartitioned.' % self.qualified_table_name
+        print 'Attached %d partitions to %s.' % (len(info.partition_bounds), self.qualified_table_name)
+        self.catalog.invalidate()
     
     def check_referencing_fkeys(self):
         refkeys_sql = '''
@@ -350,9 +1636,14 @@ class DatePartitioner(DBScript):
              'limit': self.opts.chunk
             }
         
-        # if the partition column isn't indexed prompt before continuing...
-        self.curs.execute("SELECT pgpartitioner.column_is_indexed('%(part_column)s', '%(table_name)s')" % d)
-        if not self.curs.fetchone()[0]:
+        if self.natively_partitioned():
+            print '%s is natively partitioned, there is nothing in it to migrate.' % self.qualified_table_name
+            return
+        
+        # if the partition column isn't indexed prompt before continuing,
+        # only the strategies that look up each partition's range need it
+        indexed = self.part_column in self.table_info().indexed_columns
+        if not indexed and self.opts.strategy not in ('single-pass', 'blocks'):
             while True:
                 proceed = raw_input('\n%(base_table_name)s.%(part_column)s is not indexed, this can seriously slow down data migration, proceed? (y/n):  ' % d)
                 if proceed not in ['y', 'n', 'Y', 'N', 'yes', 'no', 'Yes', 'No']:
@@ -363,10 +1654,377 @@ class DatePartitioner(DBScript):
                 break
         
         self.check_referencing_fkeys()
+        
+        if self.throttled() and self.opts.strategy == 'function':
+            self.opts.strategy = 'chunked'
+        
+        if self.opts.progress:
+            self.progress = MigrationProgress(self.qualified_table_name, self.opts.progress,
+                                              self.opts.progress_format, self.get_partition_estimates())
+        
+        if self.opts.online and self.opts.test:
+            print 'Test runs can not be split across transactions, migrating offline.'
+        elif self.opts.online:
+            self.start_throttle()
+            moved = self.migrate_online()
+            self.stop_throttle()
+            self.report_moved(moved)
+            return
+        
+        if self.opts.test and self.opts.strategy == 'blocks':
+            print 'Test runs can not be split across transactions, migrating with the single-pass strategy.'
+            self.opts.strategy = 'single-pass'
+        
+        if self.opts.strategy in ('single-pass', 'blocks'):
+            if self.opts.strategy == 'blocks':
+                moved = self.migrate_blocks()
+            else:
+                moved = self.migrate_single_pass()
+            self.report_moved(moved)
+            return
+        
+        movers = {'function': self.move_partition_function,
+                  'copy': self.move_partition_copy,
+                  'chunked': self.move_partition_chunked}
+        per_partition = self.opts.jobs > 1 or self.opts.strategy != 'function' or self.progress
+        if self.opts.test and per_partition:
+            print 'Test runs can not be split across transactions, migrating serially with the function strategy.'
+        elif per_partition:
+            if self.opts.strategy == 'chunked':
+                self.start_throttle()
+            moved = self.migrate_partitions(movers[self.opts.strategy])
+            self.stop_throttle()
+            self.report_moved(moved)
+            return
             
         self.curs.execute(move_down_sql % d)
-        moved = self.curs.fetchone()[0]
+        self.report_moved(self.curs.fetchone()[0])
+    
+    def report_moved(self, moved):
         print 'Moved %d rows into partitions.' % moved
+        if self.progress:
+            self.progress.finish(moved)
+    
+    def get_partition_estimates(self):
+        '''
+        Estimated rows to be moved into each partition from the parent's 
+        statistics, or nothing if it hasn't been analyzed.
+        '''
+        if self.partition_type != 'range':
+            return {}
+        stats = self.get_column_stats()
+        if not stats.analyzed():
+            return {}
+        estimates = {}
+        for partition, lower, upper in self.table_info().partition_bounds:
+            if upper is not None:
+                upper = self.calendar.to_number(self.parse_range_val(upper))
+            estimates[partition] = stats.range_rows(self.calendar.to_number(self.parse_range_val(lower)), upper)
+        return estimates
+    
+    def start_throttle(self):
+        '''
+        Records the limits given on the command line, if any, for the
+        chunked movers to follow.  The row is there either way so limits 
+        can be set, or the migration paused, once it's under way.
+        '''
+        limits_sql = \
+        '''
+        INSERT INTO pgpartitioner.migration_limits 
+        (parent_oid, max_rows_per_sec, max_wal_per_sec, max_replica_lag)
+        VALUES (%s::regclass, %s, %s, %s)
+        ON CONFLICT (parent_oid) DO UPDATE
+        SET max_rows_per_sec=EXCLUDED.max_rows_per_sec, max_wal_per_sec=EXCLUDED.max_wal_per_sec,
+            max_replica_lag=EXCLUDED.max_replica_lag, paused=false;
+        '''
+        
+        self.curs.execute(limits_sql, (self.qualified_table_name, self.opts.max_rate,
+                                       self.opts.max_wal_rate, self.opts.max_replica_lag))
+        self.throttle = Throttle(self.qualified_table_name)
+    
+    def stop_throttle(self):
+        if not self.throttle:
+            return
+        self.curs.execute('DELETE FROM pgpartitioner.migration_limits WHERE parent_oid=%s::regclass;',
+                          (self.qualified_table_name,))
+        self.throttle = None
+    
+    def migrate_online(self):
+        '''
+        Installs the partition trigger and then moves the parent's data in
+        chunks while the application keeps writing to it.  With the trigger
+        in place nothing new lands in the parent, but rows updated there 
+        while it's drained stay put and may be behind a partition's 
+        checkpoint, so passes are repeated until one moves nothing.
+        '''
+        self.con.commit()
+        self.install_trigger_online()
+        
+        total_moved = 0
+        passes = 1
+        while True:
+            moved = self.migrate_partitions(self.move_partition_chunked)
+            total_moved += moved
+            if not moved:
+                break
+            passes += 1
+            print 'Pass %d: checking %s for rows updated during the last pass...' % (passes, self.qualified_table_name)
+        return total_moved
+    
+    def install_trigger_online(self):
+        '''
+        Creates and commits the partition trigger.  CREATE TRIGGER has to
+        wait out every transaction using the parent and blocks everything
+        queued behind it meanwhile, so it's only allowed to wait 
+        online_lock_timeout before giving up and trying again.
+        '''
+        for attempt in range(online_lock_retries):
+            try:
+                self.curs.execute('SET LOCAL lock_timeout = %s;', (online_lock_timeout,))
+                self.set_trigger_func()
+                self.con.commit()
+                return
+            except psycopg2.OperationalError, e:
+                if e.pgcode != errorcodes.LOCK_NOT_AVAILABLE:
+                    raise
+                self.con.rollback()
+                self.catalog.invalidate(self.qualified_table_name)
+                print 'Timed out waiting to lock %s for the trigger, retrying...' % self.qualified_table_name
+                time.sleep(min(2 ** attempt, 30))
+        raise RuntimeError("Couldn't lock %s to install its partition trigger after %d tries." 
+                            % (self.qualified_table_name, online_lock_retries))
+    
+    def migrate_single_pass(self):
+        '''
+        Moves all of the parent's data with one sequential scan of it, each
+        row being routed to its partition by the generated route function
+        rather than scanning the parent for every partition's range.  Rows
+        with no partition to go to are left in the parent.
+        '''
+        self.load_route_func()
+        return self.move_routable(self.curs)
+    
+    def move_routable(self, curs, cond=None):
+        '''
+        Deletes the parent's rows, those matching cond if given, that have a
+        partition to go to and inserts what the DELETE returns into their
+        partitions.  The DELETE's qual has no side effects so a row it
+        rechecks after a concurrent update is still only moved once.
+        Returns the number of rows moved.
+        '''
+        move_sql = \
+        '''
+        WITH moved AS (
+            DELETE FROM ONLY %(table_name)s p
+            WHERE %(cond)s%(table_name)s_routable(p)
+            RETURNING p AS rec
+        )
+        SELECT count(*) FILTER (WHERE %(table_name)s_route(rec)), count(*) FROM moved;
+        '''
+        
+        curs.execute(move_sql % {'table_name': self.qualified_table_name,
+                                 'cond': cond and cond + ' AND ' or ''})
+        moved, deleted = curs.fetchone()
+        if moved != deleted:
+            raise RuntimeError("%d rows deleted from %s had no partition to go to."
+                               % (deleted - moved, self.qualified_table_name))
+        return moved
+    
+    def migrate_blocks(self):
+        '''
+        Splits the parent's heap into even ranges of blocks and runs the
+        single pass routing over each range on a pool of --jobs connections,
+        so the parent is read once, in parallel, whatever the partition 
+        column's indexing or data distribution.  Needs TID range scans
+        (PostgreSQL 14+) for each range to only read its own blocks.  Each
+        range is committed as it's done, so rows updated meanwhile into 
+        blocks already moved are picked up by a last pass over the whole 
+        parent once the workers are done.
+        '''
+        blocks_sql = "SELECT pg_relation_size(%s::regclass) / current_setting('block_size')::bigint;"
+        
+        self.load_route_func()
+        self.curs.execute(blocks_sql, (self.qualified_table_name,))
+        nblocks = self.curs.fetchone()[0]
+        
+        # a few ranges per worker so one slow range doesn't hold up the end
+        nranges = self.opts.jobs * 4
+        step = max(1, (nblocks + nranges - 1) // nranges)
+        ranges = [[start, start + step] for start in range(0, nblocks, step)] or [[0, None]]
+        # the last range is open ended to catch anything written past the end
+        ranges[-1][1] = None
+        
+        def move_blocks(curs, block_range):
+            lower, upper = block_range
+            ctid_cond = "p.ctid >= '(%d,0)'::tid" % lower
+            if upper is not None:
+                ctid_cond += " AND p.ctid < '(%d,0)'::tid" % upper
+            moved = self.move_routable(curs, ctid_cond)
+            print 'Moved %d rows from blocks %d-%s.' % (moved, lower, upper or 'end')
+            return moved
+        
+        self.con.commit()
+        moved = sum(self.run_workers(self.opts.jobs, ranges, move_blocks))
+        
+        stragglers = self.move_routable(self.curs)
+        if stragglers:
+            print 'Moved %d rows updated in %s during the migration.' % (stragglers, self.qualified_table_name)
+        return moved + stragglers
+    
+    def migrate_partitions(self, mover):
+        '''
+        Moves each partition's data from the parent with mover(curs, partition)
+        over a pool of --jobs connections.  The workers need to see the 
+        partitions and any dropped fkeys so everything up to here gets 
+        committed first.
+        '''
+        # the workers read the snapshot but mustn't load it on self.curs
+        self.partition_vals = dict([(p[0], p[2]) for p in self.table_info().partition_vals])
+        
+        if self.progress:
+            self.progress.start(self.curs, self.partitions)
+            move = mover
+            def mover(curs, partition):
+                self.progress.begin_partition(partition)
+                moved = move(curs, partition)
+                self.progress.partition_done(curs, partition, moved)
+                return moved
+        
+        self.con.commit()
+        moved = sum(self.run_workers(self.opts.jobs, self.partitions, mover))
+        
+        # the run finished so there's nothing left to resume
+        self.curs.execute('DELETE FROM pgpartitioner.migration_checkpoints WHERE parent_oid=%s::regclass;', 
+                          (self.qualified_table_name,))
+        return moved
+    
+    def range_cond(self, lower, upper):
+        '''
+        Returns a WHERE clause fragment matching the partition column values
+        in [lower, upper).
+        '''
+        cond = '%s >= %s' % (self.part_column, quote_literal(lower))
+        if upper is not None:
+            cond += ' AND %s < %s' % (self.part_column, quote_literal(upper))
+        return cond
+    
+    def partition_cond(self, vals):
+        '''
+        Returns a WHERE clause fragment matching the rows belonging in a
+        partition with the given vals.
+        '''
+        if self.partition_type == 'hash':
+            return '%s = %s' % (self.hash_bucket_sql(self.part_column, vals[0]), vals[1])
+        if self.partition_type == 'list':
+            return '%s IN (%s)' % (self.part_column, ','.join([quote_literal(v) for v in vals]))
+        return self.range_cond(vals[0], len(vals) > 1 and vals[1] or None)
+    
+    def move_partition_function(self, curs, partition):
+        '''
+        Moves a partition's data with pgpartitioner.move_partition_data().
+        '''
+        move_partition_sql = \
+        '''
+        SELECT pgpartitioner.move_partition_data(%s, %s, %s, %s);
+        '''
+        
+        curs.execute(move_partition_sql, 
+                     (self.qualified_table_name, partition, self.part_column, self.opts.chunk))
+        moved = curs.fetchone()[0]
+        print 'Moved %d rows into %s.' % (moved, partition)
+        return moved
+    
+    def move_partition_chunked(self, curs, partition):
+        '''
+        Moves a partition's data --chunk rows at a time with 
+        pgpartitioner.move_partition_chunk(), committing each chunk along
+        with the partition's checkpoint.  A partition with a checkpoint left
+        by an interrupted run starts from the last value it moved.
+        '''
+        checkpoint_sql = \
+        '''
+        SELECT last_val, moved, finished
+        FROM pgpartitioner.migration_checkpoints
+        WHERE partition_oid=%s::regclass;
+        '''
+        new_checkpoint_sql = \
+        '''
+        INSERT INTO pgpartitioner.migration_checkpoints (partition_oid, parent_oid)
+        VALUES (%s::regclass, %s::regclass);
+        '''
+        move_chunk_sql = 'SELECT * FROM pgpartitioner.move_partition_chunk(%s, %s, %s, %s, %s);'
+        update_checkpoint_sql = \
+        '''
+        UPDATE pgpartitioner.migration_checkpoints
+        SET last_val=COALESCE(%s, last_val), moved=moved + %s, finished=%s, updated=now()
+        WHERE partition_oid=%s::regclass;
+        '''
+        
+        curs.execute(checkpoint_sql, (partition,))
+        if curs.rowcount:
+            last_val, prev_moved, finished = curs.fetchone()
+            if finished:
+                print '%s was already migrated, skipping.' % partition
+                return 0
+            print 'Resuming %s from %s, %d rows already moved.' % (partition, last_val, prev_moved)
+        else:
+            last_val = None
+            curs.execute(new_checkpoint_sql, (partition, self.qualified_table_name))
+        
+        total_moved = 0
+        while True:
+            curs.execute(move_chunk_sql, (self.qualified_table_name, partition, self.part_column,
+                                          self.opts.chunk, last_val))
+            moved, chunk_last_val = curs.fetchone()
+            last_val = chunk_last_val or last_val
+            finished = moved < self.opts.chunk or not moved
+            curs.execute(update_checkpoint_sql, (chunk_last_val, moved, finished, partition))
+            curs.connection.commit()
+            total_moved += moved
+            if self.progress:
+                self.progress.chunk(curs, partition, moved)
+            if finished:
+                break
+            if self.throttle:
+                self.throttle.wait(curs, moved)
+        
+        print 'Moved %d rows into %s.' % (total_moved, partition)
+        return total_moved
+    
+    def move_partition_copy(self, curs, partition):
+        '''
+        Streams a partition's rows out of the parent with COPY TO over a 
+        second connection and into the partition with COPY FROM on curs, 
+        then deletes them from the parent.  Both sides share one 
+        repeatable read snapshot so the delete removes exactly the rows that
+        were copied and anything written to the parent meanwhile is left be.
+        '''
+        copy_out_sql = 'COPY (SELECT %s FROM ONLY %s WHERE %s) TO STDOUT WITH (FORMAT binary);'
+        copy_in_sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT binary);'
+        delete_sql = 'DELETE FROM ONLY %s WHERE %s;'
+        
+        atts = ','.join(self.table_info().attributes)
+        cond = self.partition_cond(self.partition_vals[partition])
+        
+        curs.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;')
+        curs.execute('SELECT pg_export_snapshot();')
+        snapshot = curs.fetchone()[0]
+        
+        src_con = self.get_connection()
+        try:
+            src_curs = src_con.cursor()
+            src_curs.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;')
+            src_curs.execute('SET TRANSACTION SNAPSHOT %s;', (snapshot,))
+            copy_stream(src_curs, copy_out_sql % (atts, self.qualified_table_name, cond),
+                        curs, copy_in_sql % (partition, atts))
+        finally:
+            src_con.rollback()
+            src_con.close()
+        
+        curs.execute(delete_sql % (self.qualified_table_name, cond))
+        moved = curs.rowcount
+        print 'Moved %d rows into %s.' % (moved, partition)
+        return moved
             
     def read_file(self, tpl):
         tpl_path = os.path.dirname(os.path.realpath(__file__))
@@ -384,10 +2042,134 @@ class DatePartitioner(DBScript):
                 self.finish()
                 sys.exit()
     
-    def load_templated_funcs(self):
-        funcs_tpl_sql = self.read_file('range_part_trig.tpl.sql')
-
-        table_atts = table_attributes(self.curs, self.qualified_table_name)
+    def bound_key(self, val):
+        '''
+        Sort key for partition bound values as stored in pgpartitioner.partitions.
+        Time bounds are compared as times, the bounds of a partition split
+        into sub-day ranges aren't written in the same format as the rest.
+        '''
+        return self.calendar.to_number(self.parse_range_val(val))
+    
+    def get_routing_tree(self, bounds, leaf_sql, depth=1, key=None, key_type=None, equal=False):
+        '''
+        Builds a nested IF/ELSE binary search over bounds, a list of 
+        (partition, lower, upper) tuples sorted by lower, with the bounds
+        written in as literals.  leaf_sql is formatted with the partition
+        name and is run when a row falls within that partition's range.
+        The row's partition column is searched on unless another key 
+        expression, of key_type, is given.  With equal each of the bounds
+        is a single value, (partition, value, None), to be matched exactly.
+        '''
+        indent = '    ' * depth
+        col = key or 'rec.%s' % self.part_column
+        key_type = key_type or self.col_type
+        if len(bounds) == 1:
+            partition, lower, upper = bounds[0]
+            if equal:
+                cond = '%s = %s::%s' % (col, quote_literal(lower), key_type)
+            else:
+                cond = '%s >= %s::%s' % (col, quote_literal(lower), key_type)
+            if upper is not None:
+                cond += ' AND %s < %s::%s' % (col, quote_literal(upper), key_type)
+            lines = [indent + 'IF %s THEN' % cond]
+            lines += [indent + '    ' + line for line in (leaf_sql % {'partition': partition}).splitlines()]
+            lines.append(indent + 'END IF;')
+            return '\n'.join(lines)
+        
+        mid = len(bounds) // 2
+        lines = [indent + 'IF %s < %s::%s THEN' % (col, quote_literal(bounds[mid][1]), key_type),
+                 self.get_routing_tree(bounds[:mid], leaf_sql, depth + 1, key, key_type, equal),
+                 indent + 'ELSE',
+                 self.get_routing_tree(bounds[mid:], leaf_sql, depth + 1, key, key_type, equal),
+                 indent + 'END IF;']
+        return '\n'.join(lines)
+    
+    def get_static_routing_tree(self, table_atts, ret_sql, bounds=None):
+        '''
+        Returns the routing tree over the current partitions, or the given
+        (partition, lower, upper) bounds, with each leaf inserting the row 
+        into its partition and then running ret_sql.
+        '''
+        # a static INSERT per partition passes the row's values straight
+        # through and lets plpgsql cache each partition's plan
+        leaf_sql = \
+        '''INSERT INTO %%(partition)s (%(table_atts)s) VALUES (%(rec_atts)s);
+%(ret_sql)s''' % {'table_atts': ','.join(table_atts),
+                  'rec_atts': ','.join(['rec.%s' % att for att in table_atts]),
+                  'ret_sql': ret_sql}
+        return self.get_partition_tree(leaf_sql, bounds)
+    
+    def get_partition_tree(self, leaf_sql, bounds=None):
+        '''
+        Returns the routing tree of the partition type in use over the
+        current partitions, or the given range bounds, running leaf_sql
+        for the partition a row belongs in.
+        '''
+        if bounds is None and self.partition_type == 'hash':
+            return self.get_hash_routing_tree(leaf_sql)
+        if bounds is None and self.partition_type == 'list':
+            return self.get_list_routing_tree(leaf_sql)
+        if bounds is None:
+            bounds = self.table_info().partition_bounds
+        bounds = sorted(bounds, key=lambda b: self.bound_key(b[1]))
+        return bounds and self.get_routing_tree(bounds, leaf_sql) or ''
+    
+    def get_hash_routing_tree(self, leaf_sql):
+        '''
+        The routing tree for hash partitions: a search over the remainders,
+        as [remainder, remainder + 1) ranges, of the row's hash bucket,
+        which is worked out once in a block of its own.
+        '''
+        parts = self.table_info().partition_vals
+        if not parts:
+            return ''
+        modulus = parts[0][2][0]
+        bounds = sorted([(partition, int(vals[1]), int(vals[1]) + 1) for partition, part_type, vals in parts],
+                        key=lambda b: b[1])
+        return '\n'.join(['    DECLARE',
+                          '        bucket bigint := %s;' % self.hash_bucket_sql('rec.%s' % self.part_column, modulus),
+                          '    BEGIN',
+                          self.get_routing_tree(bounds, leaf_sql, 2, 'bucket', 'bigint'),
+                          '    END;'])
+    
+    def get_list_routing_tree(self, leaf_sql):
+        '''
+        The routing tree for list partitions: a search for the row's value
+        among every partition's values.  The values are sorted by the server
+        so they're in the column type's order.
+        '''
+        sort_sql = 'SELECT i FROM unnest(%%s::text[]) WITH ORDINALITY v(val, i) ORDER BY val::%s;'
+        
+        values = [(partition, v, None) for partition, part_type, vals in self.table_info().partition_vals 
+                  for v in vals]
+        if not values:
+            return ''
+        self.curs.execute(sort_sql % self.col_type, ([v[1] for v in values],))
+        values = [values[res[0] - 1] for res in self.curs.fetchall()]
+        return self.get_routing_tree(values, leaf_sql, equal=True)
+    
+    def load_route_func(self):
+        '''
+        (Re)creates the parent's _route() function, which inserts a row of it
+        into its partition and returns whether there was one to put it in,
+        and _routable(), which only returns whether there is one.
+        '''
+        table_atts = self.table_info().attributes
+        d = {'table_name': self.qualified_table_name,
+             'routing_tree': self.get_static_routing_tree(table_atts, 'RETURN TRUE;')
+        }
+        self.curs.execute(self.read_file('range_part_route.tpl.sql') % d)
+        d['routing_tree'] = self.get_partition_tree('RETURN TRUE;')
+        self.curs.execute(self.read_file('range_part_routable.tpl.sql') % d)
+    
+    def load_templated_funcs(self, bounds=None):
+        '''
+        (Re)creates the parent table's insert function.  With the static
+        trigger type the current partitions, or the given (partition, lower,
+        upper) bounds, are compiled into the function so this needs to be 
+        re-run whenever partitions are added or removed.
+        '''
+        table_atts = self.table_info().attributes
         d = {'table_name': self.qualified_table_name,
              'base_table_name': self.table_name,
              'part_column': self.part_column,
@@ -395,22 +2177,105 @@ class DatePartitioner(DBScript):
              'atts_vals': " || ',' || ".join(["pgpartitioner.quote_nullable(rec.%s)" % att for att in table_atts]),
              'col_type': self.col_type
         }
+        
+        if self.opts.trigger == 'dynamic':
+            funcs_tpl_sql = self.read_file('range_part_trig.tpl.sql')
+        else:
+            funcs_tpl_sql = self.read_file('range_part_static_trig.tpl.sql')
+            d['routing_tree'] = self.get_static_routing_tree(table_atts, 'RETURN NULL;', bounds)
+        self.curs.execute(funcs_tpl_sql % d)
+        
+        if self.opts.routing == 'statement':
+            self.load_stmt_trig_func(d, bounds)
+    
+    def load_stmt_trig_func(self, d, bounds=None):
+        '''
+        Creates the statement level routing function.  Each partition whose
+        range overlaps the inserted batch's gets a single set based move of
+        the batch's rows in its range out of the parent.  They're matched 
+        to the inserted rows on the primary key, or on every column for
+        tables without one, so nothing else in the parent is touched.
+        '''
+        move_sql = \
+        '''
+    IF hi >= %(lower)s AND %(upper_check)s THEN
+        WITH moved AS (
+            DELETE FROM ONLY %(table_name)s p
+            USING new_rows n
+            WHERE p.%(part_column)s >= %(lower)s%(upper_cond)s AND %(match_cond)s
+            RETURNING p.*
+        )
+        INSERT INTO %(partition)s SELECT * FROM moved;
+    END IF;'''
+        pkey_re = re.compile(r'^PRIMARY KEY \((.*)\)$')
+        
+        info = self.table_info()
+        match_cond = '(p.*) IS NOT DISTINCT FROM (n.*)'
+        for contype, condef in info.constraints:
+            m = pkey_re.match(condef)
+            if contype == 'p' and m:
+                match_cond = ' AND '.join(['p.%s = n.%s' % (col, col) 
+                                           for col in [c.strip() for c in m.group(1).split(',')]])
+        
+        funcs_tpl_sql = self.read_file('range_part_stmt_trig.tpl.sql')
+        if bounds is None:
+            bounds = info.partition_bounds
+        bounds = sorted(bounds, key=lambda b: self.bound_key(b[1]))
+        moves = []
+        for partition, lower, upper in bounds:
+            m = {'table_name': self.qualified_table_name,
+                 'part_column': self.part_column,
+                 'partition': partition,
+                 'lower': '%s::%s' % (quote_literal(lower), self.col_type),
+                 'upper_check': 'TRUE',
+                 'upper_cond': '',
+                 'match_cond': match_cond}
+            if upper is not None:
+                upper = '%s::%s' % (quote_literal(upper), self.col_type)
+                m['upper_check'] = 'lo < %s' % upper
+                m['upper_cond'] = ' AND p.%s < %s' % (self.part_column, upper)
+            moves.append(move_sql % m)
+        
+        d = dict(d, routing_moves='\n'.join(moves))
         self.curs.execute(funcs_tpl_sql % d)
         
     def work(self):
         super(DatePartitioner, self).work()
         
-        if self.args[0].find('.') > -1:
-            self.qualified_table_name = self.args[0]
-            self.table_name = self.args[0].split('.')[1]
-        else:
-            self.curs.execute(def_table_schema, (self.args[0],))
-            self.qualified_table_name = self.curs.fetchone()[0]+'.'+self.args[0]
-            self.table_name = self.args[0]
+        if self.opts.maintain is not None:
+            self.maintain()
+            return
+        
+        if self.opts.expire is not None:
+            self.expire()
+            self.finish()
+            return
+        
+        if self.opts.merge:
+            self.merge()
+            self.finish()
+            return
+        
+        if self.opts.split:
+            self.split()
+            self.finish()
+            return
+        
+        info = self.catalog.table(self.args[0])
+        self.qualified_table_name = info.name
+        self.table_name = info.name.split('.', 1)[1]
         self.part_column = self.args[1]
+        self.partition_type = self.opts.partition_type
+        self.partitions = list(info.partitions)
+        self.throttle = None
+        self.progress = None
+        
+        if self.opts.plan:
+            self.plan()
+            # loading the schema is all that may have changed
+            self.con.rollback()
+            return
         
-        self.curs.execute("SELECT pgpartitioner.get_partitions('%s')" % self.qualified_table_name)
-        self.partitions = self.curs.rowcount and [res[0] for res in self.curs.fetchall()] or []
         try:
             if self.run_stage('create'):
                 # build the partitions
@@ -419,10 +2284,22 @@ class DatePartitioner(DBScript):
             if self.run_stage('migrate'):
                 self.migrate_data()
             
-            if self.run_stage('post'):
+            if self.run_stage('post') and self.natively_partitioned():
+                print '%s is natively partitioned, its partitions get their indexes from it.' % self.qualified_table_name
+            elif self.run_stage('post'):
+                if self.native():
+                    self.check_native_swap()
                 self.set_trigger_func()
-                self.build_indexes()
+                if self.opts.test and (self.opts.jobs > 1 or self.opts.concurrently):
+                    print 'Test runs can not be split across transactions, building indexes serially.'
+                    self.build_indexes()
+                elif self.opts.jobs > 1 or self.opts.concurrently:
+                    self.build_indexes_parallel()
+                else:
+                    self.build_indexes()
                 self.build_constraints()
+                if self.native():
+                    self.attach_native()
             
             self.finish()
         except Exception, e:
@@ -5,10 +5,69 @@ DROP TABLE IF EXISTS pgpartitioner.partitions;
 CREATE TABLE pgpartitioner.partitions (
     partition_oid oid PRIMARY KEY,
     parent_oid oid,
-    partition_type text CHECK (partition_type IN ('range')),
+    partition_type text CHECK (partition_type IN ('range', 'hash', 'list')),
     vals text[]
 );
 
+DROP TABLE IF EXISTS pgpartitioner.partition_versions;
+CREATE TABLE pgpartitioner.partition_versions (
+    parent_oid oid PRIMARY KEY,
+    version bigint NOT NULL
+);
+COMMENT ON TABLE pgpartitioner.partition_versions IS 'Bumped for a table whenever its rows in pgpartitioner.partitions change, so clients caching its partitions can cheaply check whether they need to reload them.';
+
+CREATE OR REPLACE FUNCTION pgpartitioner.bump_partition_version()
+    RETURNS trigger AS $$
+BEGIN
+    IF TG_OP != 'INSERT' THEN
+        INSERT INTO pgpartitioner.partition_versions (parent_oid, version) VALUES (OLD.parent_oid, 1)
+        ON CONFLICT (parent_oid) DO UPDATE SET version=partition_versions.version + 1;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.parent_oid IS DISTINCT FROM OLD.parent_oid) THEN
+        INSERT INTO pgpartitioner.partition_versions (parent_oid, version) VALUES (NEW.parent_oid, 1)
+        ON CONFLICT (parent_oid) DO UPDATE SET version=partition_versions.version + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER partitions_version_trigger AFTER INSERT OR UPDATE OR DELETE
+    ON pgpartitioner.partitions FOR EACH ROW
+    EXECUTE PROCEDURE pgpartitioner.bump_partition_version();
+
+DROP TABLE IF EXISTS pgpartitioner.parents;
+CREATE TABLE pgpartitioner.parents (
+    parent_oid oid PRIMARY KEY,
+    part_column text NOT NULL,
+    col_type text NOT NULL,
+    units text,
+    trigger_type text NOT NULL,
+    routing text NOT NULL,
+    partition_type text NOT NULL DEFAULT 'range'
+);
+COMMENT ON TABLE pgpartitioner.parents IS 'How each partitioned table was last partitioned, so its future partitions can be created without being told again.';
+COMMENT ON TABLE pgpartitioner.partitions IS 'Each partition''s parent and bounds.  vals holds the lower and upper bound of range partitions, the modulus and remainder of hash partitions and the values of list partitions.';
+
+DROP TABLE IF EXISTS pgpartitioner.migration_checkpoints;
+CREATE TABLE pgpartitioner.migration_checkpoints (
+    partition_oid oid PRIMARY KEY,
+    parent_oid oid,
+    last_val text,
+    moved bigint DEFAULT 0,
+    finished boolean DEFAULT false,
+    updated timestamp with time zone DEFAULT now()
+);
+
+DROP TABLE IF EXISTS pgpartitioner.migration_limits;
+CREATE TABLE pgpartitioner.migration_limits (
+    parent_oid oid PRIMARY KEY,
+    max_rows_per_sec real,
+    max_wal_per_sec real,
+    max_replica_lag real,
+    paused boolean NOT NULL DEFAULT false
+);
+COMMENT ON TABLE pgpartitioner.migration_limits IS 'Limits for a running chunked migration of a table: rows moved per second, server WAL bytes per second and replica replay lag in seconds, NULL for no limit.  Re-read about once a second so they can be changed, or paused set, while it runs.';
+
 CREATE OR REPLACE FUNCTION pgpartitioner.quote_nullable(val anyelement)
     RETURNS text AS $$
     SELECT COALESCE(quote_literal($1), 'NULL');
@@ -40,7 +99,7 @@ DECLARE
 BEGIN
     check_sql := 'SELECT n.nspname || ''.'' || t.relname
                   FROM pg_class t, pg_namespace n
-                  WHERE t.relkind=''r'' AND t.relnamespace=n.oid';
+                  WHERE t.relkind IN (''r'', ''p'') AND t.relnamespace=n.oid';
                   
     SELECT position('.' in table_name) INTO dot_pos;
     IF dot_pos = 0 THEN
@@ -169,6 +228,17 @@ CREATE OR REPLACE FUNCTION pgpartitioner.get_partition_bounds(partition_name tex
     SELECT vals from pgpartitioner.partitions where partition_oid=$1::regclass
 $$ LANGUAGE sql;
 
+CREATE OR REPLACE FUNCTION pgpartitioner.get_partitions_bounds(table_name text, OUT partition text, OUT vals text[])
+    RETURNS SETOF record AS $$
+    SELECT n.nspname || '.' || c.relname, p.vals
+    FROM pgpartitioner.partitions p, pg_class c, pg_namespace n
+    WHERE p.parent_oid = $1::regclass
+        AND p.partition_oid = c.oid
+        AND c.relnamespace = n.oid
+    ORDER BY c.relname
+$$ LANGUAGE sql;
+COMMENT ON FUNCTION pgpartitioner.get_partitions_bounds (table_name text) IS 'Returns each partition of the specified table along with its bounds.';
+
 CREATE OR REPLACE FUNCTION pgpartitioner.get_table_pkey_fields(table_name text)
     RETURNS text[] AS $$
     SELECT ARRAY(SELECT a.attname::text
@@ -201,96 +271,65 @@ END;
 $$ LANGUAGE plpgsql;
 COMMENT ON FUNCTION pgpartitioner.get_attributes_str_by_attnums (table_name text, attnums int[]) IS 'Given an array of integers matching attnums on the specified table, returns a CSV string of the corresponding attribute names.';
 
-CREATE OR REPLACE FUNCTION pgpartitioner.move_partition_data(src_tbl text, dst_tbl text, part_col text, count integer, max real)
-    RETURNS integer AS $$
+CREATE OR REPLACE FUNCTION pgpartitioner.move_partition_chunk(src_tbl text, dst_tbl text, part_col text, count integer, from_val text, OUT moved integer, OUT last_val text)
+    RETURNS record AS $$
 DECLARE
-    partition_points text[];
     bounds text[];
-    pkey_fields text[];
-    pkey_fields_conv text[];
-    pkeys_str text;
-    move_data_sql text;
-    moved_data_pkey text;
-    delete_sql text;
-    moved integer;
-    to_move integer DEFAULT count;
-    total_moved integer DEFAULT 0;
-    offset integer;
+    move_sql text;
 BEGIN
-    SELECT * FROM pgpartitioner.get_table_pkey_fields(src_tbl) INTO pkey_fields;
-    
-    -- make the returning clause
-    FOR i IN 1..array_upper(pkey_fields, 1)
-    LOOP
-        pkey_fields_conv[i] := pkey_fields[i] || '::text';
-    END LOOP;
-    
     SELECT * FROM pgpartitioner.get_partition_bounds(dst_tbl) INTO bounds;
     
-    offset := 0;
+    move_sql := 'WITH chunk AS (
+                     DELETE FROM ONLY ' || src_tbl || '
+                     WHERE ctid = ANY(ARRAY(
+                         SELECT ctid
+                         FROM ONLY ' || src_tbl || '
+                         WHERE ' || quote_ident(part_col) || ' >= ' || quote_literal(COALESCE(from_val, bounds[1]));
+    IF bounds[2] IS NOT NULL THEN
+        move_sql := move_sql || ' AND ' || quote_ident(part_col) || ' < ' || quote_literal(bounds[2]);
+    END IF;
+    move_sql := move_sql || '
+                         ORDER BY ' || quote_ident(part_col) || '
+                         LIMIT ' || COALESCE(count::text, 'ALL') || '))
+                     RETURNING *
+                 ), moved AS (
+                     INSERT INTO ' || dst_tbl || '
+                     SELECT * FROM chunk
+                     RETURNING ' || quote_ident(part_col) || '
+                 )
+                 SELECT count(*)::integer, max(' || quote_ident(part_col) || ')::text
+                 FROM moved';
+    EXECUTE move_sql INTO moved, last_val;
+END;
+$$ LANGUAGE plpgsql;
+COMMENT ON FUNCTION pgpartitioner.move_partition_chunk(src_tbl text, dst_tbl text, part_col text, count integer, from_val text) IS 'Moves the next count rows (all of them if count is NULL), in partition column order starting at from_val, from the parent into the partition.  Returns the number of rows moved and the highest partition column value moved.';
+
+CREATE OR REPLACE FUNCTION pgpartitioner.move_partition_data(src_tbl text, dst_tbl text, part_col text, count integer, max real)
+    RETURNS integer AS $$
+DECLARE
+    chunk_size integer;
+    chunk_moved integer;
+    from_val text;
+    total_moved integer DEFAULT 0;
+BEGIN
+    -- a count of 0 or less moves the whole range in one go
     LOOP
+        chunk_size := NULLIF(GREATEST(count, 0), 0);
         -- ensure we don't pass the max rows to be moved if it's set
-        IF total_moved + to_move > max THEN
-            to_move := max - total_moved;
-        END IF;
-        
-        pkeys_str := '';
-        move_data_sql := 'INSERT INTO ' || dst_tbl || '
-                          SELECT *
-                          FROM ONLY ' || src_tbl || '
-                          WHERE ' || quote_ident(part_col) || ' >= ' || quote_literal(bounds[1]);
-        
-        IF bounds[2] IS NOT NULL THEN
-            move_data_sql := move_data_sql || ' AND ' || quote_ident(part_col) || ' < ' || quote_literal(bounds[2]);
+        IF max != 'Infinity' AND (chunk_size IS NULL OR total_moved + chunk_size > max) THEN
+            chunk_size := max - total_moved;
         END IF;
         
-        move_data_sql := move_data_sql || '
-                          ORDER BY ' || quote_ident(part_col) || '
-                          LIMIT ' || quote_literal(to_move) || ' ';
-        RAISE NOTICE 'move data sql: %', move_data_sql;
-        IF max != 'Infinity' THEN
-            move_data_sql := move_data_sql || ' RETURNING ''('' || array_to_string(pgpartitioner.quote_array_literals(array[' || array_to_string(pkey_fields_conv, ',') || ']), '','') || '')'';';
-            FOR moved_data_pkey IN EXECUTE move_data_sql
-            LOOP
-                -- RAISE NOTICE 'move data pkey: %', moved_data_pkey;
-                pkeys_str := pkeys_str || moved_data_pkey || ',';
-            END LOOP;
+        SELECT c.moved, COALESCE(c.last_val, from_val) INTO chunk_moved, from_val
+        FROM pgpartitioner.move_partition_chunk(src_tbl, dst_tbl, part_col, chunk_size, from_val) c;
         
-            EXIT WHEN NOT FOUND;
-            GET DIAGNOSTICS moved := ROW_COUNT;
-            -- raise notice 'inserted count: %', moved;
-                    
-            pkeys_str := substring(pkeys_str from 1 for char_length(pkeys_str)-1);
-            delete_sql := 'DELETE FROM ONLY ' || src_tbl || '
-                           WHERE (' || array_to_string(pkey_fields, ',') || ') IN (' || pkeys_str ||');';
-            -- RAISE NOTICE 'delete data sql: %', delete_sql;
-            EXECUTE delete_sql;
-        ELSE
-            move_data_sql := move_data_sql || ' OFFSET ' || quote_literal(offset);
-            EXECUTE move_data_sql;
-            offset := offset + to_move;
-        END IF;
-        
-        GET DIAGNOSTICS moved := ROW_COUNT;
-        -- raise notice 'deleted count: %', moved;
-        
-        total_moved := total_moved + moved;
-        EXIT WHEN total_moved = max OR moved < count OR count = 0;
-        -- EXIT main_loop WHEN total_moved = max OR moved < count;
-        -- EXIT partition_loop WHEN moved < count;
+        total_moved := total_moved + chunk_moved;
+        EXIT WHEN chunk_size IS NULL OR chunk_moved < chunk_size OR total_moved >= max;
     END LOOP;
-    IF max = 'Infinity' THEN
-        delete_sql := 'DELETE FROM ONLY ' || src_tbl || '
-                 WHERE ' || quote_ident(part_col) || ' >= ' || quote_literal(bounds[1]);
-        IF bounds[2] IS NOT NULL THEN
-            delete_sql := delete_sql || ' AND ' || quote_ident(part_col) || ' < ' || quote_literal(bounds[2]) || ';';
-        END IF;
-        EXECUTE delete_sql;
-    END IF;
     RETURN total_moved;
 END;
 $$ LANGUAGE plpgsql;
-COMMENT ON FUNCTION pgpartitioner.move_partition_data(src_tbl text, dst_tbl text, part_col text, count integer, max real) IS 'Handles the actual moving of data using partioner schema functions.  Specifies the table to partition, the column to base partitioning on, the number of records to partition during each iteration, and the maximum amount of records to move.';
+COMMENT ON FUNCTION pgpartitioner.move_partition_data(src_tbl text, dst_tbl text, part_col text, count integer, max real) IS 'Handles the actual moving of data using partioner schema functions.  Specifies the table to partition, the column to base partitioning on, the number of records to partition during each iteration, and the maximum amount of records to move.  Rows are moved in partition column order with each iteration picking up from the last value moved, so no primary key is needed.';
 
 CREATE OR REPLACE FUNCTION pgpartitioner.move_partition_data(src_tbl text, dst_tbl text, part_col text, count integer)
     RETURNS integer AS $$
@@ -0,0 +1,192 @@
+'''
+Progress reporting for the migrate stage, for monitoring to pick up while a
+migration runs: either JSON lines appended to a file (or stdout) for each
+chunk and partition moved, or a Prometheus textfile collector file that's
+rewritten with the current totals after each one.
+'''
+
+import os, sys, time
+import json
+import threading
+
+size_sql = 'SELECT p.part, pg_relation_size(p.part::regclass) FROM unnest(%s::text[]) p(part);'
+
+metrics = [
+    ('rows_moved', 'Rows moved into the partition so far.'),
+    ('bytes_written', 'Bytes the partition has grown by so far.'),
+    ('elapsed_seconds', 'Seconds spent moving data.'),
+    ('rows_per_second', 'Average rows moved per second.'),
+    ('rows_estimated', 'Rows estimated to be moved in all, from the statistics.'),
+    ('eta_seconds', 'Estimated seconds left, from the remaining estimated rows at the current rate.'),
+]
+
+class PartitionProgress(object):
+    __slots__ = ('rows', 'bytes', 'elapsed', 'base_size', 'estimate', 'started', 'pass_rows')
+
+    def __init__(self, base_size, estimate):
+        self.rows = self.bytes = self.elapsed = self.pass_rows = 0
+        self.base_size = base_size
+        self.estimate = estimate
+        self.started = None
+
+def rate(rows, elapsed):
+    return elapsed and rows / elapsed or 0.0
+
+def eta(estimate, rows, elapsed):
+    '''
+    Seconds left to move the rest of estimate rows at the rate so far, or
+    None if there's nothing to go by yet.
+    '''
+    if estimate is None or not rows:
+        return None
+    return max(estimate - rows, 0) / rate(rows, elapsed)
+
+class MigrationProgress(object):
+    '''
+    Tracks rows and bytes moved into each partition, against the estimated
+    rows for each, and writes them out as fmt ('json' or 'prometheus') to
+    path as they change.  The workers each report on their own partitions
+    so everything shared is only touched under the lock.
+    '''
+    __slots__ = ('table_name', 'path', 'fmt', 'estimates', 'partitions', 'started', 'lock')
+
+    def __init__(self, table_name, path, fmt, estimates):
+        self.table_name = table_name
+        self.path = path
+        self.fmt = fmt
+        self.estimates = estimates
+        self.partitions = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def start(self, curs, partitions):
+        '''
+        Notes the current size of any partitions not seen before so only
+        what's written from here on is counted.
+        '''
+        new = [p for p in partitions if p not in self.partitions]
+        if not new:
+            return
+        curs.execute(size_sql, (new,))
+        for partition, size in curs.fetchall():
+            self.partitions[partition] = PartitionProgress(size, self.estimates.get(partition))
+
+    def begin_partition(self, partition):
+        '''
+        Starts the partition's clock, carrying on from any time it's already
+        had if it's moved again by a later pass.
+        '''
+        part = self.partitions[partition]
+        part.started = time.time() - part.elapsed
+        part.pass_rows = part.rows
+
+    def chunk(self, curs, partition, rows):
+        self.update(curs, partition, rows, 'chunk')
+
+    def partition_done(self, curs, partition, rows):
+        '''
+        Records the rows moved into a partition since begin_partition(),
+        less any already reported by chunk().
+        '''
+        part = self.partitions[partition]
+        self.update(curs, partition, max(rows - (part.rows - part.pass_rows), 0), 'partition')
+
+    def update(self, curs, partition, rows, event):
+        curs.execute(size_sql, ([partition],))
+        size = curs.fetchone()[1]
+        self.lock.acquire()
+        try:
+            part = self.partitions[partition]
+            now = time.time()
+            if part.started is None:
+                part.started = self.started
+            part.rows += rows
+            part.bytes = size - part.base_size
+            part.elapsed = now - part.started
+            self.write(event, partition, part)
+        finally:
+            self.lock.release()
+
+    def finish(self, rows):
+        '''
+        Writes the final totals, rows being the number moved as reported by
+        the strategy used, which may not have reported any chunks or
+        partitions along the way.
+        '''
+        self.lock.acquire()
+        try:
+            self.write('done', None, None, rows)
+        finally:
+            self.lock.release()
+
+    def totals(self):
+        rows = sum([p.rows for p in self.partitions.values()])
+        nbytes = sum([p.bytes for p in self.partitions.values()])
+        estimate = None
+        if self.estimates:
+            estimate = sum(self.estimates.values())
+        return rows, nbytes, time.time() - self.started, estimate
+
+    def write(self, event, partition, part, total_rows=None):
+        rows, nbytes, elapsed, estimate = self.totals()
+        if total_rows is not None:
+            rows = total_rows
+        if self.fmt == 'prometheus':
+            self.write_prometheus(rows, nbytes, elapsed, estimate)
+            return
+
+        total_eta = 0
+        if event != 'done':
+            total_eta = eta(estimate, rows, elapsed)
+        rec = {'time': time.time(), 'event': event, 'table': self.table_name,
+               'total_rows': rows, 'total_bytes': nbytes, 'total_elapsed': elapsed,
+               'total_rows_per_sec': rate(rows, elapsed), 'total_rows_estimated': estimate,
+               'total_eta': total_eta}
+        if part is not None:
+            rec.update({'partition': partition, 'rows': part.rows, 'bytes': part.bytes,
+                        'elapsed': part.elapsed, 'rows_per_sec': rate(part.rows, part.elapsed),
+                        'rows_estimated': part.estimate,
+                        'eta': eta(part.estimate, part.rows, part.elapsed)})
+        line = json.dumps(rec, sort_keys=True) + '\n'
+        if self.path == '-':
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            return
+        f = open(self.path, 'a')
+        try:
+            f.write(line)
+        finally:
+            f.close()
+
+    def write_prometheus(self, rows, nbytes, elapsed, estimate):
+        '''
+        Rewrites the textfile with a sample of each metric per partition
+        and for the table as a whole.  The file is written alongside and
+        renamed into place so the collector never reads half of it.
+        '''
+        samples = {}
+        table_label = 'table="%s"' % self.table_name
+        samples[table_label] = (rows, nbytes, elapsed, rate(rows, elapsed), estimate,
+                                eta(estimate, rows, elapsed))
+        for partition, part in self.partitions.items():
+            label = '%s,partition="%s"' % (table_label, partition)
+            samples[label] = (part.rows, part.bytes, part.elapsed, rate(part.rows, part.elapsed),
+                              part.estimate, eta(part.estimate, part.rows, part.elapsed))
+
+        lines = []
+        for i, (name, help) in enumerate(metrics):
+            name = 'pg_partitioner_migration_' + name
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for label in sorted(samples):
+                val = samples[label][i]
+                if val is not None:
+                    lines.append('%s{%s} %s' % (name, label, repr(float(val))))
+
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        f = open(tmp_path, 'w')
+        try:
+            f.write('\n'.join(lines) + '\n')
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,7 @@
+CREATE OR REPLACE FUNCTION %(table_name)s_routable(rec %(table_name)s)
+    RETURNS boolean AS $$
+BEGIN
+%(routing_tree)s
+    RETURN FALSE;
+END;
+$$ LANGUAGE plpgsql STABLE;
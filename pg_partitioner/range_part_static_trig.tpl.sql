@@ -0,0 +1,29 @@
+CREATE OR REPLACE FUNCTION %(table_name)s_ins_func(rec %(table_name)s)
+    RETURNS %(table_name)s AS $$
+BEGIN
+%(routing_tree)s
+    RAISE WARNING 'No partition created for %(table_name)s to hold value %(col_type)s %%, leaving data in parent table.', rec.%(part_column)s;
+    RETURN rec;
+END;
+$$ language plpgsql;
+
+
+CREATE OR REPLACE FUNCTION %(table_name)s_ins_trig()
+    RETURNS trigger AS $$
+DECLARE
+    res %(table_name)s;
+    null_rec %(table_name)s;
+BEGIN
+    -- a row updated while it's still in the parent stays there for the
+    -- migration to move, inserting it into a partition here would leave
+    -- the old version behind in the parent as a duplicate
+    IF TG_OP = 'UPDATE' THEN
+        RETURN NEW;
+    END IF;
+    SELECT INTO res * FROM %(table_name)s_ins_func(NEW);
+    IF row(res.*) IS DISTINCT FROM row(null_rec.*) THEN
+        RETURN NEW;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,15 @@
+CREATE OR REPLACE FUNCTION %(table_name)s_stmt_trig()
+    RETURNS trigger AS $$
+DECLARE
+    lo %(col_type)s;
+    hi %(col_type)s;
+BEGIN
+    SELECT MIN(%(part_column)s), MAX(%(part_column)s) INTO lo, hi FROM new_rows;
+    IF lo IS NULL THEN
+        RETURN NULL;
+    END IF;
+    
+%(routing_moves)s
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -28,6 +28,12 @@ DECLARE
     res %(table_name)s;
     null_rec %(table_name)s;
 BEGIN
+    -- a row updated while it's still in the parent stays there for the
+    -- migration to move, inserting it into a partition here would leave
+    -- the old version behind in the parent as a duplicate
+    IF TG_OP = 'UPDATE' THEN
+        RETURN NEW;
+    END IF;
     SELECT INTO res * FROM %(table_name)s_ins_func(NEW);
     IF row(res.*) IS DISTINCT FROM row(null_rec.*) THEN
         RETURN NEW;
@@ -6,6 +6,8 @@
 
 import sys, os
 import getpass
+import threading
+from Queue import Queue, Empty
 import psycopg2
 from psycopg2.extras import DictConnection
 from optparse import OptionParser
@@ -75,7 +77,7 @@ class DBScript(Script):
         pass
     
     def find_db_pass(self, conn_params):
-        password = os.environ.get('PGPASSWORD', '')
+        password = getattr(self, 'password', '') or os.environ.get('PGPASSWORD', '')
         if password:
             return password
             
@@ -105,7 +107,7 @@ class DBScript(Script):
             return DictConnection(conn_str % conn_params)
         except psycopg2.OperationalError, e:
             if str(e).strip().endswith('no password supplied'):
-                conn_params['password'] = getpass.getpass('password: ')
+                conn_params['password'] = self.password = getpass.getpass('password: ')
                 conn_str += ' password=%(password)s'
                 print conn_str % conn_params
                 return DictConnection(conn_str % conn_params)
@@ -113,6 +115,54 @@ class DBScript(Script):
         except psycopg2.Error, e:
             raise e
     
+    def run_workers(self, jobs, work, func):
+        '''
+        Runs func(curs, item) for each item in work over a pool of jobs
+        connections.  Every item is committed on its own as soon as func
+        returns, or rolled back for test runs.  If any item fails the
+        remaining items are abandoned and the error is re-raised here.
+        Returns the list of func's return values.
+        '''
+        queue = Queue()
+        for item in work:
+            queue.put(item)
+        results = []
+        errors = []
+        lock = threading.Lock()
+        
+        def worker(con):
+            curs = con.cursor()
+            try:
+                while not errors:
+                    try:
+                        item = queue.get_nowait()
+                    except Empty:
+                        break
+                    res = func(curs, item)
+                    if self.opts.test:
+                        con.rollback()
+                    else:
+                        con.commit()
+                    lock.acquire()
+                    results.append(res)
+                    lock.release()
+            except Exception:
+                con.rollback()
+                errors.append(sys.exc_info())
+            con.close()
+        
+        # connect up front so any password prompt happens here
+        cons = [self.get_connection() for i in range(max(1, min(jobs, len(work))))]
+        threads = [threading.Thread(target=worker, args=(con,)) for con in cons]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return results
+    
     def  finish(self):
         if self.opts.test:
             print 'Rolling back test run.'
@@ -1,3 +1,5 @@
+import os, sys, errno
+import threading
 
 def table_exists(curs, table_name=''):
     '''
@@ -52,3 +54,78 @@ def normalize_date(curs, date_str, fmt, units='month', diff='0 months'):
     '''
     curs.execute(normalize_date_sql, (units, date_str, diff, fmt))
     return curs.fetchone()[0]
+
+def get_partitions_bounds(curs, table_name):
+    '''
+    Returns a list of (partition, lower, upper) 3-tuples for each partition
+    registered for table_name.  upper is None for open ended partitions.
+    '''
+    curs.execute('SELECT * FROM pgpartitioner.get_partitions_bounds(%s);', (table_name,))
+    bounds = []
+    for partition, vals in curs.fetchall():
+        vals = list(vals or []) + [None, None]
+        bounds.append((partition, vals[0], vals[1]))
+    return bounds
+
+def quote_literal(val):
+    '''
+    Returns val as a quoted SQL string literal.
+    '''
+    return "'%s'" % str(val).replace("'", "''")
+
+def copy_stream(src_curs, copy_out_sql, dst_curs, copy_in_sql, size=8192):
+    '''
+    Pipes the output of a COPY ... TO STDOUT run on src_curs straight into
+    a COPY ... FROM STDIN run on dst_curs.  The data goes through an OS pipe
+    so no more than a pipe buffer's worth is held in memory at once.  The
+    two cursors must belong to different connections.
+    '''
+    r, w = os.pipe()
+    reader, writer = os.fdopen(r, 'rb'), os.fdopen(w, 'wb')
+    errors = []
+    
+    def copy_out():
+        try:
+            try:
+                src_curs.copy_expert(copy_out_sql, writer, size)
+            except IOError, e:
+                # a broken pipe means the COPY in gave up, that's its error to report
+                if e.errno != errno.EPIPE:
+                    errors.append(sys.exc_info())
+            except Exception:
+                errors.append(sys.exc_info())
+        finally:
+            try:
+                writer.close()
+            except (IOError, OSError):
+                pass
+    
+    t = threading.Thread(target=copy_out)
+    t.start()
+    try:
+        dst_curs.copy_expert(copy_in_sql, reader, size)
+    except Exception:
+        # closing the read end unblocks the writer if the COPY in failed
+        reader.close()
+        t.join()
+        if not errors:
+            raise
+    else:
+        reader.close()
+        t.join()
+    # a failed COPY out shows up on the COPY in as truncated input, report
+    # the original error instead
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+def existing_tables(curs, table_names):
+    '''
+    Returns the set of the given schema qualified table names that exist.
+    '''
+    if not table_names:
+        return set()
+    curs.execute('''SELECT n.nspname || '.' || t.relname
+                    FROM pg_class t, pg_namespace n
+                    WHERE t.relnamespace=n.oid AND n.nspname || '.' || t.relname = ANY(%s);''',
+                 (list(table_names),))
+    return set([res[0] for res in curs.fetchall()])
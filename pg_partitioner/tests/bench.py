@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# Benchmarks the partitioner against synthetic tables in a throwaway
+# PostgreSQL cluster (initdb'd into a temp directory and removed afterwards)
+# and writes the results as JSON so runs can be compared:
+#
+#   * inserts: rows/s inserted through the parent's partition trigger, for
+#     each --trigger and --routing type, against inserting the same rows
+#     straight into the partitions
+#   * migrate: rows/s moved out of the parent by each --strategy, and for
+#     the chunked ones each chunk size, along with the post stage's time
+#
+# Every table is generated from a fixed random seed so runs with the same
+# options work on the same data.  Use --database to run against an existing
+# database instead of a throwaway cluster.
+
+import os, sys, time
+import json
+import shutil
+import socket
+import tempfile
+from datetime import datetime, timedelta
+from optparse import OptionParser
+from subprocess import check_call
+import psycopg2
+
+script = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'pg_partitioner.py')
+table = 'bench_parent'
+start_date = '2008-01-01'
+
+def init_optparse():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--rows', type='int', default=100000,
+                      help="Rows in each generated table.  Default: 100000")
+    parser.add_option('--width', type='int', default=10,
+                      help="Extra text columns on each generated table.  Default: 10")
+    parser.add_option('--partitions', type='int', default=30,
+                      help="Partitions, one per day, the rows are spread over.  Default: 30")
+    parser.add_option('--skew', type='float', default=0.0,
+                      help="How much the rows bunch up in the latest partitions, 0 for evenly spread, 1 for half of them in the latest quarter of the partitions.  Default: 0")
+    parser.add_option('--strategies', default='function,chunked,copy,single-pass,blocks',
+                      help="Comma separated --strategy values to benchmark the migrate stage with.  Default: all of them")
+    parser.add_option('--chunks', default='1000,10000',
+                      help="Comma separated --chunk sizes for the function and chunked strategies.  Default: 1000,10000")
+    parser.add_option('-j', '--jobs', type='int', default=1,
+                      help="--jobs for the migrate and post stages.  Default: 1")
+    parser.add_option('-o', '--output', default='bench_results.json',
+                      help="File the results are written to.  Default: bench_results.json")
+    parser.add_option('--pg-bin', default='',
+                      help="Directory holding initdb and pg_ctl if they aren't on the PATH.")
+    parser.add_option('-d', '--database',
+                      help="Benchmark in this existing database rather than a throwaway cluster.")
+    return parser
+
+class ThrowawayCluster(object):
+    '''
+    A PostgreSQL cluster in a temp directory, listening only on a unix
+    socket in that directory, deleted by stop().
+    '''
+    def __init__(self, pg_bin):
+        self.pg_bin = pg_bin
+        self.dir = tempfile.mkdtemp(prefix='pg_partitioner_bench')
+        self.data = os.path.join(self.dir, 'data')
+        self.port = free_port()
+
+    def start(self):
+        devnull = open(os.devnull, 'w')
+        check_call([os.path.join(self.pg_bin, 'initdb'), '-D', self.data, '-A', 'trust',
+                    '-U', 'postgres'], stdout=devnull)
+        opts = "-p %d -k %s -c listen_addresses='' -c fsync=off" % (self.port, self.dir)
+        check_call([os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.data, '-o', opts, '-w',
+                    '-l', os.path.join(self.dir, 'log'), 'start'], stdout=devnull)
+        con = psycopg2.connect(self.dsn('postgres'))
+        con.autocommit = True
+        con.cursor().execute('CREATE DATABASE bench;')
+        con.close()
+
+    def stop(self):
+        devnull = open(os.devnull, 'w')
+        try:
+            check_call([os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.data, '-m', 'fast',
+                        '-w', 'stop'], stdout=devnull)
+        finally:
+            shutil.rmtree(self.dir)
+
+    def dsn(self, dbname='bench'):
+        return 'dbname=%s host=%s port=%d user=postgres' % (dbname, self.dir, self.port)
+
+    def script_args(self):
+        return ['-d', 'bench', '-h', self.dir, '-p', str(self.port), '-U', 'postgres']
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class Bench(object):
+    def __init__(self, opts, dsn, script_args):
+        self.opts = opts
+        self.script_args = script_args
+        self.con = psycopg2.connect(dsn)
+        self.curs = self.con.cursor()
+
+    def cols(self):
+        return ['c%d' % i for i in range(self.opts.width)]
+
+    def create_table(self):
+        self.curs.execute('DROP TABLE IF EXISTS %s CASCADE;' % table)
+        self.curs.execute('''
+        CREATE TABLE %s (
+            id bigserial PRIMARY KEY,
+            val_ts timestamp without time zone NOT NULL,
+            %s
+        );
+        CREATE INDEX %s_val_ts_idx ON %s (val_ts);
+        ''' % (table, ',\n'.join(['%s text' % c for c in self.cols()]), table, table))
+        self.con.commit()
+
+    def create_rows(self):
+        '''
+        Generates the benchmark rows once into a table of their own, indexed
+        on val_ts so each partition's share can be read straight out of it.
+        The day of each row is drawn so that a --skew of s puts a fraction
+        of about x^(1/(1+s)) of the rows in the latest x of the days.
+        '''
+        cols = self.cols()
+        vals = ', '.join(['md5((i + %d)::text) AS %s' % (i, c) for i, c in enumerate(cols)])
+        self.curs.execute('DROP TABLE IF EXISTS %s_rows;' % table)
+        self.curs.execute('SELECT setseed(0.5);')
+        self.curs.execute('''
+        CREATE TABLE %(table)s_rows AS
+        SELECT '%(start)s'::timestamp
+            + (%(days)d - 1 - floor(%(days)d * power(random(), 1 + %(skew)s)))::integer * interval '1 day'
+            + (i %% 86400) * interval '1 second' AS val_ts, %(vals)s
+        FROM generate_series(1, %(rows)d) i;
+        CREATE INDEX %(table)s_rows_val_ts_idx ON %(table)s_rows (val_ts);
+        ANALYZE %(table)s_rows;
+        ''' % {'table': table, 'vals': vals, 'start': start_date, 'days': self.opts.partitions,
+               'skew': self.opts.skew, 'rows': self.opts.rows})
+        self.con.commit()
+
+    def insert(self, target, where=''):
+        cols = 'val_ts, ' + ', '.join(self.cols())
+        start = time.time()
+        self.curs.execute('INSERT INTO %s (%s) SELECT %s FROM %s_rows %s;' % (target, cols, cols, table, where))
+        self.con.commit()
+        return time.time() - start
+
+    def partition(self, stage, *args):
+        end_date = (datetime.strptime(start_date, '%Y-%m-%d') 
+                    + timedelta(days=self.opts.partitions - 1)).strftime('%Y-%m-%d')
+        cmd = ['python', script] + self.script_args + ['-u', 'day', '-s', start_date, '-e', end_date,
+                                                       '--stage', stage] + list(args) + [table, 'val_ts']
+        start = time.time()
+        check_call(cmd, stdout=open(os.devnull, 'w'))
+        return time.time() - start
+
+    def count(self, only=''):
+        self.curs.execute('SELECT count(*) FROM %s %s;' % (only, table))
+        return self.curs.fetchone()[0]
+
+    def partition_bounds(self):
+        self.curs.execute('SELECT partition, vals[1], vals[2] FROM pgpartitioner.get_partitions_bounds(%s);', (table,))
+        return self.curs.fetchall()
+
+    def bench_inserts(self):
+        '''
+        Times the same rows inserted through each kind of partition trigger
+        and straight into the partitions, one INSERT ... SELECT per partition.
+        '''
+        results = []
+        for trigger, routing in [('static', 'row'), ('dynamic', 'row'), ('static', 'statement')]:
+            self.create_table()
+            self.partition('all', '--trigger', trigger, '--routing', routing)
+            elapsed = self.insert(table)
+            assert self.count('ONLY') == 0, 'rows were left in the parent'
+            results.append({'target': '%s %s trigger' % (trigger, routing), 'seconds': elapsed,
+                            'rows_per_sec': self.opts.rows / elapsed})
+            print '%-26s %8.2fs %10.0f rows/s' % (results[-1]['target'], elapsed, self.opts.rows / elapsed)
+
+        elapsed = 0
+        for partition, lower, upper in self.partition_bounds():
+            elapsed += self.insert(partition, "WHERE val_ts >= '%s' AND val_ts < '%s'" % (lower, upper))
+        results.append({'target': 'partitions directly', 'seconds': elapsed,
+                        'rows_per_sec': self.opts.rows / elapsed})
+        print '%-26s %8.2fs %10.0f rows/s' % (results[-1]['target'], elapsed, self.opts.rows / elapsed)
+        return results
+
+    def bench_migrations(self):
+        '''
+        Times the migrate stage with each strategy, and chunk size where it
+        applies, on a freshly loaded parent, then the post stage after it.
+        '''
+        results = []
+        for strategy in self.opts.strategies.split(','):
+            chunks = [None]
+            if strategy in ('function', 'chunked'):
+                chunks = [int(c) for c in self.opts.chunks.split(',')]
+            for chunk in chunks:
+                self.create_table()
+                self.insert(table)
+                self.curs.execute('ANALYZE %s;' % table)
+                self.con.commit()
+                self.partition('create')
+
+                args = ['--strategy', strategy, '-j', str(self.opts.jobs)]
+                if chunk:
+                    args += ['--chunk', str(chunk)]
+                migrate = self.partition('migrate', *args)
+                assert self.count('ONLY') == 0, 'rows were left in the parent'
+                post = self.partition('post', '-j', str(self.opts.jobs))
+
+                results.append({'strategy': strategy, 'chunk': chunk, 'jobs': self.opts.jobs,
+                                'migrate_seconds': migrate, 'rows_per_sec': self.opts.rows / migrate,
+                                'post_seconds': post})
+                print '%-12s chunk %-8s %8.2fs %10.0f rows/s  post %8.2fs' % \
+                        (strategy, chunk or '-', migrate, self.opts.rows / migrate, post)
+        return results
+
+    def run(self):
+        self.curs.execute('SHOW server_version;')
+        version = self.curs.fetchone()[0]
+        print 'PostgreSQL %s, %d rows, %d text columns, %d partitions, skew %s:' % \
+                (version, self.opts.rows, self.opts.width, self.opts.partitions, self.opts.skew)
+        self.create_rows()
+        print '\nInserts:'
+        inserts = self.bench_inserts()
+        print '\nMigrations:'
+        migrations = self.bench_migrations()
+
+        self.curs.execute('DROP TABLE %s CASCADE; DROP TABLE %s_rows;' % (table, table))
+        self.con.commit()
+        return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'server_version': version,
+                'params': {'rows': self.opts.rows, 'width': self.opts.width,
+                           'partitions': self.opts.partitions, 'skew': self.opts.skew,
+                           'jobs': self.opts.jobs},
+                'inserts': inserts, 'migrations': migrations}
+
+if __name__ == '__main__':
+    opts, args = init_optparse().parse_args()
+
+    cluster = None
+    if opts.database:
+        dsn, script_args = 'dbname=%s' % opts.database, ['-d', opts.database]
+    else:
+        cluster = ThrowawayCluster(opts.pg_bin)
+        cluster.start()
+        dsn, script_args = cluster.dsn(), cluster.script_args()
+
+    try:
+        results = Bench(opts, dsn, script_args).run()
+    finally:
+        if cluster:
+            cluster.stop()
+
+    f = open(opts.output, 'w')
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.close()
+    print '\nResults written to %s' % opts.output
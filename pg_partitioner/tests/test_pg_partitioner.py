@@ -1,7 +1,10 @@
 
 from pydbtest import dbtestcase
-import sys, os, subprocess
+import sys, os, subprocess, time
+import json, gzip, hashlib, shutil, tempfile
 from copy import copy
+from datetime import datetime
+from pg_partitioner.partition_map import PartitionMap
 
 def setUpModule():
     os.chdir(os.path.dirname(__file__))
@@ -102,6 +105,17 @@ class TestDatePartitioner(dbtestcase.DBTestCase):
         cmd = script+" -u month -s 20080101 foo val_ts"
         self.runTableValidations(cmd, '20080101', '20090101', '1 month')
     
+    def testCreatesHourRanges(self):
+        cmd = script+" -u hour --scale 2 -s 20080101 -e 20080101050000 foo val_ts"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        
+        for hour in ['00', '02', '04']:
+            part = self.default_schema+'.'+(self.part_fmt % ('20080101%s0000' % hour))
+            self.assertTableExists(part)
+            self.assertNotEqual(output.find('Creating '+part), -1)
+        self.assertTableNotExists(self.part_fmt % '20080101060000')
+    
     def testParentGetsInsertTrigger(self):
         cmd = script+" -u month --stage all foo val_ts"
         self.callproc(cmd)
@@ -130,6 +144,30 @@ class TestDatePartitioner(dbtestcase.DBTestCase):
             self.assertTableHasIndex(tbl, tbl+'_val_ts_idx', columns='val_ts')
             self.assertTableHasPrimaryKey(tbl, 'id')
     
+    def testParallelConcurrentIndexBuilds(self):
+        cmd = script+" -u month -s 20080101 -e 20080201 --stage all --jobs 2 --concurrently foo val_ts"
+        self.runTableValidations(cmd, '20080101', '20080201', '1 month')
+        
+        for tbl in ['foo_20080101', 'foo_20080201']:
+            self.assertTableHasIndex(tbl, tbl+'_val_idx', columns='val')
+            self.assertTableHasIndex(tbl, tbl+'_val_ts_idx', columns='val_ts')
+            self.assertTableHasPrimaryKey(tbl, 'id')
+    
+    def testParallelIndexBuildsSkipExistingIndexes(self):
+        cmd = script+" -u month -s 20080101 -e 20080201 --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "CREATE INDEX foo_20080101_val_idx ON foo_20080101 (val);"
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month -s 20080101 -e 20080201 --stage post --jobs 2 foo val_ts"
+        self.callproc(cmd)
+        
+        for tbl in ['foo_20080101', 'foo_20080201']:
+            self.assertTableHasIndex(tbl, tbl+'_val_idx', columns='val')
+            self.assertTableHasIndex(tbl, tbl+'_val_ts_idx', columns='val_ts')
+    
     def testPartitionSchemaMatchesParentWithFkeys(self):
         cmd = script+" -u month -s 20080101 -e 20080201 -f --stage all foo val_ts"
         self.runTableValidations(cmd, '20080101', '20080201', '1 month')
@@ -163,6 +201,198 @@ class TestDatePartitioner(dbtestcase.DBTestCase):
         output = p.stdout.read()
         self.assertNotEqual(output.find('Moved 7 rows into partitions.'), -1)
     
+    def testParallelMigrateMovesAllData(self):
+        cmd = script+" -u month foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage migrate --jobs 3 foo val_ts"        
+        sts, p = self.callproc(cmd)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Moved 7 rows into partitions.'), -1)
+    
+    def testCopyStrategyMigratesAllData(self):
+        cmd = script+" -u month foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage migrate --strategy copy foo val_ts"        
+        sts, p = self.callproc(cmd)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Moved 7 rows into partitions.'), -1)
+    
+    def testChunkedStrategyResumesFromCheckpoint(self):
+        cmd = script+" -u month foo val_ts"
+        self.callproc(cmd)
+        
+        # pretend an earlier run got as far as finishing 2008-01
+        sql = \
+        '''
+        INSERT INTO pgpartitioner.migration_checkpoints (partition_oid, parent_oid, last_val, moved, finished)
+        VALUES ('foo_20080101'::regclass, 'foo'::regclass, '20080101', 1, true);
+        '''
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month --stage migrate --strategy chunked --chunk 2 foo val_ts"        
+        sts, p = self.callproc(cmd)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+        
+        sql = "SELECT COUNT(*) FROM pgpartitioner.migration_checkpoints;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('foo_20080101 was already migrated, skipping.'), -1)
+        self.assertNotEqual(output.find('Moved 6 rows into partitions.'), -1)
+    
+    def testChunkedMovesWorkWithoutPrimaryKey(self):
+        # identical rows that nothing but their position tells apart
+        sql = \
+        '''
+        ALTER TABLE foo DROP CONSTRAINT foo_pkey;
+        INSERT INTO foo (id, val, val_ts) VALUES (1, 5, '20080101'), (1, 5, '20080101'), (1, 5, '20080101');
+        '''
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month foo val_ts"
+        self.callproc(cmd)
+        
+        for strategy in ['function', 'chunked']:
+            cmd = script+" -u month --stage migrate --strategy %s --chunk 2 foo val_ts" % strategy
+            sts, p = self.callproc(cmd)
+            output = p.stdout.read()
+            
+            sql = "SELECT COUNT(*) FROM ONLY foo;"
+            self.exec_query(sql)
+            self.assertEqual(self.cursor().fetchone()[0], 0)
+            
+            sql = "SELECT COUNT(*) FROM ONLY foo_20080101;"
+            self.exec_query(sql)
+            self.assertEqual(self.cursor().fetchone()[0], 4)
+            
+            sql = "SELECT COUNT(*) FROM foo;"
+            self.exec_query(sql)
+            self.assertEqual(self.cursor().fetchone()[0], 10)
+            
+            self.assertNotEqual(output.find('Moved 10 rows into partitions.'), -1)
+            
+            # put everything back in the parent for the next strategy
+            sql = \
+            '''
+            WITH moved AS (DELETE FROM foo RETURNING *)
+            INSERT INTO foo SELECT * FROM moved;
+            '''
+            self.exec_query(sql)
+            self._commit()
+    
+    def testSinglePassStrategyKeepsUnroutableDataInParent(self):
+        cmd = script+" -u month -s 20080201 -e 20080501 foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month -s 20080201 -e 20080501 --stage migrate --strategy single-pass foo val_ts"
+        sts, p = self.callproc(cmd)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 4)
+        
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Moved 3 rows into partitions.'), -1)
+    
+    def testSinglePassMovesConcurrentlyUpdatedRowsOnce(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        # the migration has to wait on this row and recheck it
+        sql = "UPDATE foo SET val=val+1 WHERE val_ts='20080101';"
+        self.exec_query(sql)
+        
+        cmd = script+" -u month --stage migrate --strategy single-pass foo val_ts"
+        p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        time.sleep(2)
+        self._commit()
+        p.wait()
+        
+        sql = "SELECT val FROM foo WHERE val_ts='20080101';"
+        self.exec_query(sql)
+        self.assertEqual([res[0] for res in self.cursor().fetchall()], [6])
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testBlocksStrategyMigratesAllData(self):
+        cmd = script+" -u month foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage migrate --strategy blocks --jobs 2 foo val_ts"
+        sts, p = self.callproc(cmd)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Moved 7 rows into partitions.'), -1)
+    
+    def testBlocksStrategyMovesConcurrentlyUpdatedRowsOnce(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "UPDATE foo SET val=val+1 WHERE val_ts='20080101';"
+        self.exec_query(sql)
+        
+        cmd = script+" -u month --stage migrate --strategy blocks --jobs 2 foo val_ts"
+        p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        time.sleep(2)
+        self._commit()
+        p.wait()
+        
+        sql = "SELECT val FROM foo WHERE val_ts='20080101';"
+        self.exec_query(sql)
+        self.assertEqual([res[0] for res in self.cursor().fetchall()], [6])
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
     def testLimitedRangeKeepsDataInParent(self):
         cmd = script+" -u month -s 20080201 -e 20080501 foo val_ts"
         self.callproc(cmd)
@@ -231,6 +461,888 @@ class TestDatePartitioner(dbtestcase.DBTestCase):
         self.assertEqual(only+1, self.cursor().fetchone()[0])
         only += 1
         
+    def testStaticInsertFuncHasNoPartitionLookups(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT prosrc FROM pg_proc WHERE proname='foo_ins_func';"
+        self.exec_query(sql)
+        src = self.cursor().fetchone()[0]
+        self.assertEqual(src.find('get_partitions'), -1)
+        self.assertNotEqual(src.find("'20080101'"), -1)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo_20080601;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+    
+    def testDynamicInsertFuncLooksUpPartitions(self):
+        cmd = script+" -u month --trigger dynamic --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT prosrc FROM pg_proc WHERE proname='foo_ins_func';"
+        self.exec_query(sql)
+        src = self.cursor().fetchone()[0]
+        self.assertNotEqual(src.find('get_partitions'), -1)
+    
+    def testStatementRoutingMovesBatch(self):
+        cmd = script+" -u month --routing statement --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        self.assertTableHasTrigger('foo', 'foo_partition_trigger', before=False, 
+                                        events='insert', row=False)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622'), (61, '20080623'), (70, '20080702'), (80, '20001010');"
+        self.exec_query(sql)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo_20080601;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 2)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo_20080701;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+    
+    def testStatementRoutingOnlyMovesInsertedRows(self):
+        cmd = script+" -u month --routing statement --stage create foo val_ts"
+        self.callproc(cmd)
+        cmd = script+" -u month --routing statement --stage post foo val_ts"
+        self.callproc(cmd)
+        
+        # foo's rows haven't been migrated, the insert mustn't move them
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080115'), (61, '20080116');"
+        self.exec_query(sql)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo_20080101;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 2)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        self.exec_query("ALTER TABLE foo DROP CONSTRAINT foo_pkey;")
+        self._commit()
+        self.callproc(script+" -u month --routing statement --stage create foo val_ts")
+        sql = "INSERT INTO foo (val, val_ts) VALUES (62, '20080117');"
+        self.exec_query(sql)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo_20080101;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 3)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+    
+    def testOnlineMigrateInstallsTriggerAndDrainsParent(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage migrate --online --chunk 2 foo val_ts"
+        self.callproc(cmd)
+        
+        self.assertTableHasTrigger('foo', 'foo_partition_trigger', before=True, 
+                                        events='insert', row=True)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM pgpartitioner.migration_checkpoints;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testUpdatesToParentRowsArentDuplicated(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        cmd = script+" -u month --stage post foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "UPDATE foo SET val=val+1 WHERE val_ts='20080101';"
+        self.exec_query(sql)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT val FROM ONLY foo WHERE val_ts='20080101';"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 6)
+    
+    def testThrottledMigrationMovesAllData(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage migrate --chunk 1 --max-rate 100 --max-wal-rate 100MB foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM pgpartitioner.migration_limits;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testMaxRatePacesMigration(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        # 7 single row chunks at 2 rows a second
+        start = time.time()
+        cmd = script+" -u month --stage migrate --chunk 1 --max-rate 2 foo val_ts"
+        self.callproc(cmd)
+        self.assertTrue(time.time() - start >= 3)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testPausedMigrationMovesNothing(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage migrate --chunk 1 --max-rate 2 foo val_ts"
+        p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        
+        sql = "UPDATE pgpartitioner.migration_limits SET paused=true WHERE parent_oid='foo'::regclass;"
+        for i in range(50):
+            self.exec_query(sql)
+            updated = self.cursor().rowcount
+            self._commit()
+            if updated:
+                break
+            time.sleep(0.2)
+        # give the workers time to see the pause
+        time.sleep(2)
+        
+        counts = []
+        for i in range(2):
+            self.exec_query("SELECT COUNT(*) FROM ONLY foo;")
+            counts.append(self.cursor().fetchone()[0])
+            self._commit()
+            time.sleep(2)
+        self.assertEqual(counts[0], counts[1])
+        self.assertTrue(counts[0] > 0)
+        
+        # the held worker isn't holding a transaction open
+        sql = \
+        '''
+        SELECT COUNT(*) FROM pg_stat_activity
+        WHERE datname=current_database() AND state IN ('idle in transaction', 'idle in transaction (aborted)') AND pid != pg_backend_pid();
+        '''
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "UPDATE pgpartitioner.migration_limits SET paused=false WHERE parent_oid='foo'::regclass;"
+        self.exec_query(sql)
+        self._commit()
+        p.wait()
+        self.assertNotEqual(p.stdout.read().find('Holding the migration of'), -1)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testProgressReportsChunksAsJsonLines(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        progress_file = os.path.join(os.getcwd(), 'progress_test.json')
+        cmd = script+" -u month --stage migrate --strategy chunked --chunk 1 --progress %s foo val_ts" % progress_file
+        self.callproc(cmd)
+        
+        events = [json.loads(line) for line in open(progress_file)]
+        os.remove(progress_file)
+        self.assertEqual(len([e for e in events if e['event'] == 'chunk' and e['rows']]), 7)
+        self.assertEqual(events[-1]['event'], 'done')
+        self.assertEqual(events[-1]['total_rows'], 7)
+        
+        part_events = [e for e in events if e['event'] == 'partition' and e['partition'].endswith('foo_20080101')]
+        self.assertEqual(part_events[0]['rows'], 1)
+    
+    def testProgressRefusesSinglePassStrategies(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        for strategy in ['single-pass', 'blocks']:
+            cmd = script+" -u month --stage migrate --strategy %s --progress - foo val_ts" % strategy
+            sts, p = self.callproc(cmd)
+            self.assertNotEqual(sts, 0)
+            self.assertNotEqual(p.stdout.read().find('--progress reports on each partition'), -1)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+    
+    def testMaintainCreatesFuturePartitions(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" --maintain 3"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        
+        sql = "SELECT to_char(date_trunc('month', localtimestamp) + %s * interval '1 month', 'YYYYMMDD');"
+        for i in range(1, 4):
+            self.exec_query(sql, (i,))
+            part = self.default_schema+'.'+(self.part_fmt % self.cursor().fetchone()[0])
+            self.assertTableExists(part)
+            self.assertNotEqual(output.find('Creating '+part), -1)
+        
+        # nothing more to do the second time round
+        sts, p = self.callproc(cmd)
+        self.assertEqual(p.stdout.read().find('Creating '), -1)
+        
+        sql = "SELECT to_char(localtimestamp + interval '1 month', 'YYYY-MM-DD');"
+        self.exec_query(sql)
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, %s);"
+        self.exec_query(sql, (self.cursor().fetchone()[0],))
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testMaintainSkipsOpenEndedParents(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "UPDATE pgpartitioner.partitions SET vals=vals[1:1] WHERE partition_oid='foo_20090101'::regclass;"
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" --maintain 3 foo"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        self.assertEqual(output.find('Creating '), -1)
+        self.assertNotEqual(output.find('its newest partition is open ended'), -1)
+    
+    def testMaintainCarriesOnPastAFailingParent(self):
+        cmd = script+" -u month --stage create foo val_ts"
+        self.callproc(cmd)
+        
+        sql = \
+        '''
+        CREATE TABLE bar (id serial PRIMARY KEY, val_ts timestamp NOT NULL);
+        INSERT INTO bar (val_ts) VALUES ('20080101');
+        '''
+        self.exec_query(sql)
+        self._commit()
+        cmd = script+" -u month --stage create bar val_ts"
+        self.callproc(cmd)
+        
+        sql = "UPDATE pgpartitioner.parents SET units='1 fortnight' WHERE parent_oid='foo'::regclass;"
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" --maintain 2"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        self.exec_query("DROP TABLE bar CASCADE;")
+        self._commit()
+        
+        self.assertEqual(sts, 0)
+        self.assertNotEqual(output.find('Failed to maintain %s.foo' % self.default_schema), -1)
+        self.assertNotEqual(output.find('Creating %s.bar_' % self.default_schema), -1)
+    
+    def testExpireArchivesAndDropsOldPartitions(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        archive_dir = tempfile.mkdtemp()
+        cmd = script+" --expire 20080101 --archive-dir %s -j 2 foo" % archive_dir
+        self.callproc(cmd)
+        
+        entries = [json.loads(line) for line in open(os.path.join(archive_dir, 'manifest.jsonl'))]
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(sum([e['rows'] for e in entries]), 2)
+        
+        date = '20070701'
+        while date < '20080101':
+            part = self.default_schema+'.'+(self.part_fmt % date)
+            self.assertTableNotExists(part)
+            path = os.path.join(archive_dir, part+'.copy.gz')
+            entry = [e for e in entries if e['partition'] == part][0]
+            self.assertEqual(hashlib.sha256(open(path, 'rb').read()).hexdigest(), entry['sha256'])
+            self.assertEqual(len(gzip.open(path).readlines()), entry['rows'])
+            date = self.nextInterval('1 month', date)
+        self.assertTableExists(self.default_schema+'.'+(self.part_fmt % '20080101'))
+        shutil.rmtree(archive_dir)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 5)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622');"
+        self.exec_query(sql)
+        
+        # the expired ranges fall back on the parent
+        sql = "INSERT INTO foo (val, val_ts) VALUES (61, '20070822');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+    
+    def testExpireStopsDynamicRoutingToExpiredPartitions(self):
+        cmd = script+" -u month --trigger dynamic --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        archive_dir = tempfile.mkdtemp()
+        cmd = script+" --expire 20080101 --archive-dir %s foo" % archive_dir
+        self.callproc(cmd)
+        shutil.rmtree(archive_dir)
+        
+        sql = "SELECT COUNT(*) FROM pgpartitioner.partitions WHERE parent_oid='foo'::regclass AND vals[2] <= '20080101';"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (61, '20070822');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+    
+    def testFailedExpireOnlyRecordsWhatWasDropped(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        # the view stops foo_20071101 from being dropped
+        sql = "CREATE VIEW foo_nov AS SELECT * FROM foo_20071101;"
+        self.exec_query(sql)
+        self._commit()
+        
+        archive_dir = tempfile.mkdtemp()
+        cmd = script+" --expire 20080101 --archive-dir %s foo" % archive_dir
+        sts, p = self.callproc(cmd)
+        self.assertNotEqual(sts, 0)
+        
+        entries = [json.loads(line) for line in open(os.path.join(archive_dir, 'manifest.jsonl'))]
+        shutil.rmtree(archive_dir)
+        part = lambda date: self.default_schema+'.'+(self.part_fmt % date)
+        self.assertEqual(sorted([e['partition'] for e in entries]),
+                         [part('20070701'), part('20070801'), part('20070901'), part('20071001')])
+        
+        for date in ['20071101', '20071201']:
+            self.assertTableExists(part(date))
+            sql = "SELECT COUNT(*) FROM pgpartitioner.partitions WHERE partition_oid=%s::regclass;"
+            self.exec_query(sql, (part(date),))
+            self.assertEqual(self.cursor().fetchone()[0], 1)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (61, '20071122');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM foo_20071101;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 2)
+    
+    def testExpireTestRunWritesNoArchives(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        archive_dir = tempfile.mkdtemp()
+        cmd = script+" --expire 20080101 --archive-dir %s -j 2 -t foo" % archive_dir
+        self.callproc(cmd)
+        
+        self.assertEqual(os.listdir(archive_dir), [])
+        shutil.rmtree(archive_dir)
+        self.assertTableExists(self.default_schema+'.'+(self.part_fmt % '20070701'))
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (61, '20070822');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testMergeCombinesAdjacentPartitions(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" --merge 20080101 20080401 foo"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Merged 3 partitions of'), -1)
+        
+        tbl = 'foo_20080101'
+        self.assertTableNotExists(self.default_schema+'.foo_20080201')
+        self.assertTableNotExists(self.default_schema+'.foo_20080301')
+        self.assertTableNotExists(self.default_schema+'.foo_20080101_new')
+        self.assertTableHasCheckConstraint(tbl, tbl+'_val_ts_check')
+        self.assertTableHasIndex(tbl, tbl+'_val_idx', columns='val')
+        self.assertTableHasIndex(tbl, tbl+'_val_ts_idx', columns='val_ts')
+        self.assertTableHasPrimaryKey(tbl, 'id')
+        
+        sql = "SELECT vals FROM pgpartitioner.partitions WHERE partition_oid='foo_20080101'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], ['20080101', '20080401'])
+        
+        sql = "SELECT COUNT(*) FROM foo_20080101;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 2)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080322');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM foo_20080101;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 3)
+    
+    def testCreateAfterMergeSkipsMergedRanges(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        cmd = script+" --merge 20080101 20080401 foo"
+        self.callproc(cmd)
+        
+        cmd = script+" -u month --stage all foo val_ts"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        
+        for date in ['20080201', '20080301']:
+            part = self.default_schema+'.'+(self.part_fmt % date)
+            self.assertTableNotExists(part)
+            self.assertNotEqual(output.find('%s is already covered by %s.foo_20080101' % (part, self.default_schema)), -1)
+        
+        sql = "SELECT COUNT(*) FROM pgpartitioner.partitions WHERE parent_oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 17)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080322');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM foo_20080101;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 3)
+    
+    def testSplitDividesPartition(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080115'), (61, '20080131');"
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" --split foo_20080101 -u day --scale 10 -j 2 foo"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Split %s.foo_20080101 into 4 partitions.' % self.default_schema), -1)
+        
+        for date, rows in [('20080101', 1), ('20080111', 1), ('20080121', 0), ('20080131', 1)]:
+            tbl = self.part_fmt % date
+            self.assertTableNotExists(self.default_schema+'.'+tbl+'_new')
+            self.assertTableHasCheckConstraint(tbl, tbl+'_val_ts_check')
+            self.assertTableHasIndex(tbl, tbl+'_val_idx', columns='val')
+            self.assertTableHasPrimaryKey(tbl, 'id')
+            self.exec_query("SELECT COUNT(*) FROM %s;" % tbl)
+            self.assertEqual(self.cursor().fetchone()[0], rows)
+        
+        sql = "SELECT vals FROM pgpartitioner.partitions WHERE partition_oid='foo_20080131'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], ['20080131', '20080201'])
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 9)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (62, '20080125');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM foo_20080121;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+    
+    def testSplitIntoHoursKeepsRoutingAroundIt(self):
+        cmd = script+" -u day -s 20080101 -e 20080103 --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        cmd = script+" --split foo_20080102 -u hour --scale 12 foo"
+        sts, p = self.callproc(cmd)
+        self.assertNotEqual(p.stdout.read().find('Split %s.foo_20080102 into 2 partitions.' % self.default_schema), -1)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '2008-01-01 10:00'), (61, '2008-01-02 13:00'), (62, '2008-01-03 10:00');"
+        self.exec_query(sql)
+        
+        for tbl, rows in [('foo_20080101', 2), ('foo_20080102000000', 0), ('foo_20080102120000', 1), ('foo_20080103', 1)]:
+            self.exec_query("SELECT COUNT(*) FROM %s;" % tbl)
+            self.assertEqual(self.cursor().fetchone()[0], rows)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo WHERE val >= 60;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testPartitionMapRoutesAndPrunes(self):
+        cmd = script+" -u month --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        pmap = PartitionMap(self.cursor(), 'foo')
+        self.assertEqual(len(pmap), 19)
+        part = lambda date: self.default_schema+'.'+(self.part_fmt % date)
+        self.assertEqual(pmap.route(datetime(2008, 2, 2)), part('20080201'))
+        self.assertEqual(pmap.route(datetime(2008, 3, 1)), part('20080301'))
+        self.assertEqual(pmap.route(datetime(2007, 6, 30)), None)
+        self.assertEqual(pmap.route(datetime(2009, 2, 1)), None)
+        self.assertEqual(pmap.prune(datetime(2008, 1, 15), datetime(2008, 3, 1)), 
+                         [part('20080101'), part('20080201')])
+        self.assertEqual(pmap.prune(None, datetime(2007, 8, 1)), [part('20070701')])
+        self.assertEqual(pmap.prune(datetime(2009, 1, 1)), [part('20090101')])
+        self.assertEqual(pmap.prune(datetime(2010, 1, 1)), [])
+        
+        self.assertFalse(pmap.refresh(self.cursor()))
+        cmd = script+" --merge 20080101 20080401 foo"
+        self.callproc(cmd)
+        self.assertTrue(pmap.refresh(self.cursor()))
+        self.assertEqual(len(pmap), 17)
+        self.assertEqual(pmap.route(datetime(2008, 3, 1)), part('20080101'))
+    
+    def testHashPartitionsSpreadRows(self):
+        cmd = script+" --partition-type hash --modulus 4 --stage all foo val"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        
+        counts = []
+        for r in range(4):
+            tbl = self.part_fmt % r
+            self.assertNotEqual(output.find('Creating %s.%s' % (self.default_schema, tbl)), -1)
+            self.assertTableHasIndex(tbl, tbl+'_val_idx', columns='val')
+            self.assertTableHasPrimaryKey(tbl, 'id')
+            sql = "SELECT COUNT(*) FROM ONLY %s WHERE (abs(hashint8(val::bigint)::bigint) %% 4) != %d;" % (tbl, r)
+            self.exec_query(sql)
+            self.assertEqual(self.cursor().fetchone()[0], 0)
+            self.exec_query("SELECT COUNT(*) FROM %s;" % tbl)
+            counts.append(self.cursor().fetchone()[0])
+        self.assertEqual(sum(counts), 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        sql = "SELECT COUNT(*) FROM foo WHERE val=60;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+    
+    def testHashPartitionsOnUuids(self):
+        sql = \
+        '''
+        ALTER TABLE foo ADD COLUMN uid uuid;
+        UPDATE foo SET uid=md5(id::text)::uuid;
+        '''
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" --partition-type hash --modulus 4 --stage all foo uid"
+        self.callproc(cmd)
+        
+        counts = []
+        for r in range(4):
+            tbl = self.part_fmt % r
+            sql = "SELECT COUNT(*) FROM ONLY %s WHERE (abs(uuid_hash(uid)::bigint) %% 4) != %d;" % (tbl, r)
+            self.exec_query(sql)
+            self.assertEqual(self.cursor().fetchone()[0], 0)
+            self.exec_query("SELECT COUNT(*) FROM %s;" % tbl)
+            counts.append(self.cursor().fetchone()[0])
+        self.assertEqual(sum(counts), 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
+    def testHashPartitioningRejectsTimestamps(self):
+        # a timestamp's text form depends on the session's DateStyle
+        cmd = script+" --partition-type hash --modulus 4 --stage all foo val_ts"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        self.assertNotEqual(sts, 0)
+        self.assertNotEqual(output.find('--partition-type hash needs an integer, text, uuid, bytea or date column'), -1)
+        self.assertTableNotExists(self.default_schema+'.'+(self.part_fmt % 0))
+    
+    def testListPartitionsHoldTheirValues(self):
+        cmd = script+" --partition-type list --values 3,5;6,10 --stage all foo val"
+        sts, p = self.callproc(cmd)
+        output = p.stdout.read()
+        self.assertNotEqual(output.find('Moved 5 rows into partitions.'), -1)
+        
+        for tbl, rows in [('foo_0', 3), ('foo_1', 2)]:
+            self.assertTableHasCheckConstraint(tbl, tbl+'_val_check')
+            self.exec_query("SELECT COUNT(*) FROM %s;" % tbl)
+            self.assertEqual(self.cursor().fetchone()[0], rows)
+        
+        sql = "SELECT vals FROM pgpartitioner.partitions WHERE partition_oid='foo_1'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], ['6', '10'])
+        
+        # values with no partition stay in the parent
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 2)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (10, '20080622');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM foo_1;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 3)
+    
+    def testNativeBackendAttachesPartitions(self):
+        cmd = script+" -u month --backend native --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT relkind FROM pg_class WHERE oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 'p')
+        
+        sql = "SELECT COUNT(*) FROM pg_trigger WHERE tgrelid='foo'::regclass AND NOT tgisinternal;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "SELECT COUNT(*) FROM pgpartitioner.partitions WHERE parent_oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 19)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM foo_20080601;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 8)
+        
+        sql = "SELECT COUNT(*) FROM foo_unpartitioned;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        self.exec_query("DROP TABLE foo_unpartitioned;")
+    
+    def testNativeBackendKeepsParentsConstraintsAndGrants(self):
+        sql = \
+        '''
+        ALTER TABLE foo ADD CONSTRAINT foo_val_check CHECK (val >= 0);
+        COMMENT ON TABLE foo IS 'foos';
+        COMMENT ON COLUMN foo.val IS 'a val';
+        GRANT SELECT ON foo TO PUBLIC;
+        '''
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month --backend native --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT relkind FROM pg_class WHERE oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 'p')
+        
+        sql = "SELECT contype FROM pg_constraint WHERE conrelid='foo'::regclass ORDER BY contype;"
+        self.exec_query(sql)
+        self.assertEqual([res[0] for res in self.cursor().fetchall()], ['c', 'f'])
+        
+        sql = "SELECT obj_description('foo'::regclass, 'pg_class'), col_description('foo'::regclass, 2);"
+        self.exec_query(sql)
+        self.assertEqual(list(self.cursor().fetchone()), ['foos', 'a val'])
+        
+        sql = "SELECT has_table_privilege('public', 'foo', 'SELECT');"
+        self.exec_query(sql)
+        self.assertTrue(self.cursor().fetchone()[0])
+        
+        self.exec_query("DROP TABLE foo_unpartitioned;")
+    
+    def testNativeBackendPartitionChecksRuleOutNulls(self):
+        sql = \
+        '''
+        ALTER TABLE foo ALTER val_ts DROP NOT NULL;
+        INSERT INTO foo (val, val_ts) VALUES (60, NULL);
+        '''
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month --backend native --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT relkind FROM pg_class WHERE oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 'p')
+        
+        sql = \
+        '''
+        SELECT pg_get_constraintdef(oid) FROM pg_constraint 
+        WHERE conrelid='foo_20080101'::regclass AND contype='c';
+        '''
+        self.exec_query(sql)
+        self.assertNotEqual(self.cursor().fetchone()[0].find('val_ts IS NOT NULL'), -1)
+        
+        sql = "SELECT COUNT(*) FROM foo_unpartitioned WHERE val_ts IS NULL;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 1)
+        
+        self.exec_query("DROP TABLE foo_unpartitioned;")
+    
+    def testNativeBackendRefusesToLeaveViewsBehind(self):
+        sql = "CREATE VIEW foo_view AS SELECT * FROM foo;"
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month --backend native --stage all foo val_ts"
+        sts, p = self.callproc(cmd)
+        self.assertNotEqual(p.stdout.read().find('view foo_view'), -1)
+        
+        sql = "SELECT relkind FROM pg_class WHERE oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 'r')
+        self.assertTableNotExists(self.default_schema+'.foo_unpartitioned')
+    
+    def testNativeBackendRowsStayVisibleUntilAttached(self):
+        cmd = script+" -u month --backend native --stage create foo val_ts"
+        self.callproc(cmd)
+        cmd = script+" -u month --backend native --stage migrate --jobs 2 foo val_ts"
+        self.callproc(cmd)
+        
+        # between the stages the migrated rows are still read through foo
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        # a row that got into the parent anyway is moved at the swap
+        sql = \
+        '''
+        ALTER TABLE foo DISABLE TRIGGER foo_partition_trigger;
+        INSERT INTO foo (val, val_ts) VALUES (61, '20080623');
+        ALTER TABLE foo ENABLE TRIGGER foo_partition_trigger;
+        '''
+        self.exec_query(sql)
+        self._commit()
+        
+        cmd = script+" -u month --backend native --stage post foo val_ts"
+        self.callproc(cmd)
+        
+        sql = "SELECT relkind FROM pg_class WHERE oid='foo'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 'p')
+        
+        sql = "SELECT COUNT(*) FROM foo_20080601;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 2)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 9)
+        
+        sql = "SELECT COUNT(*) FROM foo_unpartitioned;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "SELECT COUNT(*) FROM pg_inherits WHERE inhparent='foo_unpartitioned'::regclass;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        self.exec_query("DROP TABLE foo_unpartitioned;")
+    
+    def testPlanChangesNothing(self):
+        self.exec_query("ANALYZE foo;")
+        self._commit()
+        
+        cmd = script+" -u month --stage all --plan foo val_ts"
+        sts, p = self.callproc(cmd)
+        
+        output = p.stdout.read()
+        date = '20070701'
+        while date <= '20090101':
+            part = self.default_schema+'.'+(self.part_fmt % date)
+            self.assertTableNotExists(part)
+            self.assertNotEqual(output.find(part), -1)
+            date = self.nextInterval('1 month', date)
+        
+        self.assertNotEqual(output.find('CREATE TABLE'), -1)
+        self.assertNotEqual(output.find('Estimated time:'), -1)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+    
+    def testTargetRowsFromSampleSetsBounds(self):
+        # sampling all of the table gives exact counts per month
+        cmd = script+" -u month --target-rows 2 --sample 100 --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = \
+        '''
+        SELECT partition_oid::regclass::text, vals
+        FROM pgpartitioner.partitions
+        WHERE parent_oid='foo'::regclass
+        ORDER BY vals[1];
+        '''
+        self.exec_query(sql)
+        # the empty months are folded into the partitions before them
+        self.assertEqual(self.cursor().fetchall(),
+                         [('foo_20070701', ['20070701', '20080101']),
+                          ('foo_20080101', ['20080101', '20080401']),
+                          ('foo_20080401', ['20080401', '20090101']),
+                          ('foo_20090101', ['20090101', '20090201'])])
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "SELECT COUNT(*) FROM foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 7)
+    
+    def testTargetRowsFromStatsLeavesNothingInParent(self):
+        self.exec_query("ANALYZE foo;")
+        self._commit()
+        
+        cmd = script+" -u month --target-rows 3 --stage all foo val_ts"
+        self.callproc(cmd)
+        
+        sql = \
+        '''
+        SELECT vals[1], vals[2], lead(vals[1]) OVER (ORDER BY vals[1])
+        FROM pgpartitioner.partitions
+        WHERE parent_oid='foo'::regclass
+        ORDER BY vals[1];
+        '''
+        self.exec_query(sql)
+        bounds = self.cursor().fetchall()
+        self.assertTrue(1 < len(bounds) < 19)
+        self.assertEqual(bounds[0][0], '20070701')
+        # no gaps between the partitions for rows to fall through
+        for lower, upper, next_lower in bounds[:-1]:
+            self.assertEqual(upper, next_lower)
+        
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+        
+        sql = "INSERT INTO foo (val, val_ts) VALUES (60, '20080622');"
+        self.exec_query(sql)
+        sql = "SELECT COUNT(*) FROM ONLY foo;"
+        self.exec_query(sql)
+        self.assertEqual(self.cursor().fetchone()[0], 0)
+    
     def testRunWithTestFlagDoesntCommit(self):
         cmd = script+" -u month -t foo val_ts"
         sts, p = self.callproc(cmd)
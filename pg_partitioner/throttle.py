@@ -0,0 +1,111 @@
+'''
+Pacing for the chunked migration loop.  The limits live in a row of
+pgpartitioner.migration_limits so they can be changed, or the migration
+paused, while it runs:
+
+    UPDATE pgpartitioner.migration_limits SET max_rows_per_sec=5000
+    WHERE parent_oid='foo'::regclass;
+'''
+
+import time
+import threading
+
+limits_sql = \
+'''
+SELECT max_rows_per_sec, max_wal_per_sec, max_replica_lag, paused
+FROM pgpartitioner.migration_limits
+WHERE parent_oid=%s::regclass;
+'''
+
+wal_lsn_sql = "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0');"
+
+# replay_lag is NULL once a replica has caught up and gone idle
+replica_lag_sql = "SELECT COALESCE(extract(epoch FROM max(replay_lag)), 0) FROM pg_stat_replication;"
+
+# seconds between re-reading the limits, and between checks while paused
+refresh_interval = 1.0
+
+class Throttle(object):
+    '''
+    Spaces out the chunks moved by any number of workers so that, between
+    them, they stay under the rows per second and server WAL bytes per
+    second limits, and holds them while paused or while any replica's
+    replay lag is over its limit.  A limit of NULL is no limit.
+    '''
+    __slots__ = ('table_name', 'limits', 'lock', 'next_time', 'last_lsn', 'last_refresh')
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.limits = (None, None, None, False)
+        self.lock = threading.Lock()
+        self.next_time = 0
+        self.last_lsn = None
+        self.last_refresh = 0
+
+    def refresh(self, curs):
+        if time.time() - self.last_refresh < refresh_interval:
+            return
+        curs.execute(limits_sql, (self.table_name,))
+        self.limits = curs.fetchone() or (None, None, None, False)
+        self.last_refresh = time.time()
+
+    def wait(self, curs, rows):
+        '''
+        Called by a worker after each chunk it commits with the number of
+        rows moved, sleeps for as long as the limits call for.  The limits
+        are read in a transaction of their own, committed before sleeping.
+        '''
+        self.lock.acquire()
+        try:
+            self.refresh(curs)
+            max_rows, max_wal, max_lag, paused = self.limits
+            # each chunk pushes back the earliest time the next one may
+            # start, so time spent idle can't be saved up for a burst
+            until = max(self.next_time, time.time())
+            if max_rows:
+                until += rows / float(max_rows)
+            if max_wal:
+                curs.execute(wal_lsn_sql)
+                lsn = float(curs.fetchone()[0])
+                if self.last_lsn is not None:
+                    until += max(lsn - self.last_lsn, 0) / max_wal
+                self.last_lsn = lsn
+            self.next_time = until
+            # don't sit idle in a transaction holding a snapshot while asleep
+            curs.connection.commit()
+        finally:
+            self.lock.release()
+
+        delay = until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.hold(curs)
+
+    def hold(self, curs):
+        '''
+        Blocks while the migration is paused or a replica is lagging.
+        '''
+        waiting = None
+        while True:
+            self.lock.acquire()
+            try:
+                self.refresh(curs)
+                max_rows, max_wal, max_lag, paused = self.limits
+                lag = 0
+                if max_lag is not None and not paused:
+                    curs.execute(replica_lag_sql)
+                    lag = curs.fetchone()[0]
+                curs.connection.commit()
+            finally:
+                self.lock.release()
+
+            if paused:
+                reason = 'paused'
+            elif max_lag is not None and lag > max_lag:
+                reason = 'replica lag %.1fs over %.1fs' % (lag, max_lag)
+            else:
+                return
+            if reason != waiting:
+                print 'Holding the migration of %s: %s.' % (self.table_name, reason)
+                waiting = reason
+            time.sleep(refresh_interval)